@@ -1,84 +1,1249 @@
+import time
+STARTED_AT = time.perf_counter() # Taken before any other import, for the startup benchmark
 import tkinter as tk
-import requests  # Requests for weather from http
 from tkinter import messagebox
-from PIL import Image, ImageTk  # Processing and displaying images
-from ttkbootstrap import ttk
+from tkinter import ttk # Stock widgets, ttkbootstrap would import PIL at startup
 from tkinter.ttk import Style # ttk theme
-import matplotlib.pyplot as plt # Plot hourly forecast
 from datetime import datetime, timedelta # Convert time into human time
-import folium # Create wind flow direction map
 import webbrowser # Open map as html in browser
+import importlib # Load heavy dependencies on first use
+import subprocess # Run the startup benchmark in fresh processes
+import statistics
+import atexit # Write pending history when a headless run ends
 import os
+import io
+import re
+import pathlib # File URLs for the saved maps
+import sys
+import math
+import zlib # Stable per-city numbers for synthetic replay payloads
+import tempfile # Scratch cache folders for the benchmark and replay runs
+import shutil
+import json # Write bulk results as JSON lines
+try:
+    import orjson # Faster JSON decoding of API responses when installed
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+import argparse # Command line modes (GUI or headless)
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+import gzip
+import pickle # Compact binary city index file
+import sqlite3 # Observation history store
+import bisect # Prefix search in the sorted city index
+import heapq # Next refresh time of each favourite city
+import random # Jitter the background refreshes
+import unicodedata # Fold accents out of city names
+from array import array # Compact columns for the city index
+import contextlib # No-op timer while instrumentation is off
+import threading # Guard the cache across worker threads
+import queue # Hand results from worker threads back to the Tk thread
+from collections import OrderedDict, deque, Counter # LRU order for the response cache, sliding window of API calls
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed # Fetch independent endpoints concurrently
+
+# -------------------------------------------------------------------------------------
+# Create a class for a module that is only imported when one of its attributes is first used
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    # Function to import the module now (used to warm it up in the background)
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    # Function to check whether the module has been imported yet
+    def is_loaded(self):
+        return self._module is not None or self._name in sys.modules
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+
+# Heavy dependencies, imported on first use so the window opens without them
+requests = LazyModule("requests")  # Requests for weather from http
+requests_adapters = LazyModule("requests.adapters")  # Connection pooling for the shared session
+urllib3_retry = LazyModule("urllib3.util.retry")  # Retry with backoff on 429/5xx
+Image = LazyModule("PIL.Image")  # Processing and displaying images
+ImageTk = LazyModule("PIL.ImageTk")
+np = LazyModule("numpy")  # Columnar forecast arrays
+mpl_figure = LazyModule("matplotlib.figure")  # Plot hourly forecast
+mpl_tkagg = LazyModule("matplotlib.backends.backend_tkagg")  # Embed the hourly chart in Tk
+folium = LazyModule("folium")  # Create wind flow direction map
+asyncio = LazyModule("asyncio")  # Headless JSON service only, the window never needs it
+LAZY_MODULES = (requests, requests_adapters, urllib3_retry, Image, ImageTk, np, mpl_figure, mpl_tkagg, folium)
+
+
+# Function to import every heavy dependency ahead of first use (runs in a worker thread)
+def warm_up_imports(modules=LAZY_MODULES):
+    for module in modules:
+        try:
+            module.load()
+        except ImportError:
+            pass  # The feature needing it reports the error when used
+
+# Base URL of the OpenWeatherMap API
+BASE_URL = "https://api.openweathermap.org/data/2.5"
+# Units requested from OpenWeatherMap (°C and m/s), so no temperature is converted client-side
+UNITS = "metric"
+# 3-hour forecast slots requested for the hourly view (the 5-day view requests all 40)
+HOURLY_SLOTS = 8
+# URL of the weather condition icons
+ICON_URL = "https://openweathermap.org/img/wn/{icon_id}@2x.png"
+# Every OpenWeatherMap condition icon id (day and night variants)
+ICON_IDS = [f"{code}{part}" for code in ("01", "02", "03", "04", "09", "10", "11", "13", "50") for part in ("d", "n")]
+# Folder for files kept between runs
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "weatherwise")
+# Favourite cities refreshed in the background
+FAVOURITES_PATH = os.path.join(CACHE_DIR, "favourites.json")
+# -------------------------------------------------------------------------------------
+# Create a class for the app's instrumentation: per-stage timers, counters and gauges
+# Off by default, when off stage() returns a shared no-op context and count() returns at once
+class Metrics:
+    NULL_STAGE = contextlib.nullcontext()
+
+    def __init__(self):
+        self.enabled = False
+        self.gauges = {}  # name -> function returning the current value (e.g. API calls in the last minute)
+        self._lock = threading.Lock()
+        self._log = None  # File receiving one JSON line per timed stage
+        self.reset()
+
+    # Function to turn instrumentation on, optionally logging every timed stage as a JSON line to a file
+    def enable(self, log_path=None):
+        if log_path is not None and self._log is None:
+            self._log = open(log_path, "a", encoding="utf-8", buffering=1)
+        self.enabled = True
+
+    # Function to turn instrumentation off (collected values are kept)
+    def disable(self):
+        self.enabled = False
+
+    # Function to forget every collected value
+    def reset(self):
+        with self._lock:
+            self.stages = {}  # name -> [count, total seconds, max seconds]
+            self.counters = Counter()
+
+    # Function to time a block: with METRICS.stage("http.weather"): ...
+    def stage(self, name):
+        if not self.enabled:
+            return self.NULL_STAGE
+        return MetricsStage(self, name)
+
+    # Function to wrap func so each call is timed as a stage
+    def timed(self, name, func):
+        def timed_func(*args):
+            with self.stage(name):
+                return func(*args)
+        return timed_func
+
+    # Function to add the duration of one stage
+    def record(self, name, seconds):
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                entry = self.stages[name] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            if self._log is not None:
+                self._log.write(json.dumps({"time": round(time.time(), 3), "stage": name, "ms": round(seconds * 1000, 3),
+                                            "thread": threading.current_thread().name}) + "\n")
+
+    # Function to add to a counter (requests.weather, bytes.forecast, cache.hit, ...)
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += amount
+
+    # Function to register a value read whenever a snapshot is taken
+    def gauge(self, name, func):
+        self.gauges[name] = func
+
+    # Function to get every value as a JSON-ready dict, times in ms
+    def snapshot(self):
+        with self._lock:
+            stages = {name: {"count": count, "total_ms": round(total * 1000, 3), "avg_ms": round(total * 1000 / count, 3),
+                             "max_ms": round(longest * 1000, 3)} for name, (count, total, longest) in sorted(self.stages.items())}
+            counters = dict(sorted(self.counters.items()))
+
+        def hit_rate(hits, lookups):
+            return round(hits / lookups, 3) if lookups else None
+
+        return {"stages": stages, "counters": counters,
+                "cache_hit_rate": hit_rate(counters.get("cache.hit", 0) + counters.get("cache.stale", 0),
+                                           sum(counters.get(f"cache.{kind}", 0) for kind in ("hit", "stale", "miss"))),
+                "icon_hit_rate": hit_rate(counters.get("icons.memory", 0) + counters.get("icons.disk", 0),
+                                          sum(counters.get(f"icons.{kind}", 0) for kind in ("memory", "disk", "download"))),
+                "gauges": {name: func() for name, func in self.gauges.items()}}
+
+    # Function to write the final snapshot to the log and close it
+    def close(self):
+        if self._log is not None:
+            self._log.write(json.dumps({"time": round(time.time(), 3), "summary": self.snapshot()}) + "\n")
+            self._log.close()
+            self._log = None
+
+
+# Create a class for one running stage timer
+class MetricsStage:
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+# Instrumentation shared by the whole app, enabled by --metrics or the debug panel (F12)
+METRICS = Metrics()
+# -------------------------------------------------------------------------------------
+# Create a class to cache API responses (TTL + LRU, with stale-while-revalidate)
+class ResponseCache:
+    def __init__(self, ttl=600, stale_ttl=1800, max_size=128):
+        self.ttl = ttl  # Seconds an entry is served as fresh
+        self.stale_ttl = stale_ttl  # Extra seconds an expired entry may still be served while it is refreshed
+        self.max_size = max_size  # Maximum number of entries before the least recently used is evicted
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Function to look up a key, returns (value, is_fresh) or None if missing/too old
+    # counted=False leaves the hit-rate counters alone, for callers that count one logical lookup themselves
+    def get(self, key, counted=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            result = None
+            if entry is not None:
+                value, stored_at = entry
+                age = time.monotonic() - stored_at
+                if age > self.ttl + self.stale_ttl:
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+                    result = (value, age <= self.ttl)
+        if counted:
+            self.count_lookup(result)
+        return result
+
+    # Function to count a lookup result as a hit, a stale hit or a miss
+    @staticmethod
+    def count_lookup(result):
+        METRICS.count("cache.miss" if result is None else "cache.hit" if result[1] else "cache.stale")
+
+    # Function to store a value and evict the least recently used entries over the size bound
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    # Function to drop every cached entry
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+# -------------------------------------------------------------------------------------
+# Create a class for the shared HTTP transport (pooled keep-alive connections, timeouts and retries)
+class HTTPTransport:
+    # Connection pool size per host, hosts not listed here use pool_maxsize
+    HOST_POOL_SIZES = {
+        "https://api.openweathermap.org": 10,
+        "https://openweathermap.org": 6,
+    }
+
+    def __init__(self, pool_connections=4, pool_maxsize=4, host_pool_sizes=None, connect_timeout=3.05,
+                 read_timeout=10, retries=3, backoff_factor=0.5):
+        self.timeout = (connect_timeout, read_timeout)  # Seconds to connect and to wait for each read
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.host_pool_sizes = host_pool_sizes or self.HOST_POOL_SIZES
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._session = None  # Created on first request, so requests is not imported at startup
+        self._session_lock = threading.Lock()
+
+    # The pooled requests.Session, built on first use
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    # Function to build the session with its connection pools and retry policy
+    def _create_session(self):
+        HTTPAdapter = requests_adapters.HTTPAdapter
+        session = requests.Session()
+
+        # Bounded retries with exponential backoff, honouring Retry-After on 429
+        retry = urllib3_retry.Retry(total=self.retries, backoff_factor=self.backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+                                    allowed_methods=frozenset(["GET"]), respect_retry_after_header=True, raise_on_status=False)
+
+        session.mount("https://", HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry))
+        session.mount("http://", HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry))
+        # Mount a dedicated adapter for each known host so its pool can be sized separately
+        for prefix, size in self.host_pool_sizes.items():
+            session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=retry))
+        return session
+
+    # Function to send a GET request over the pooled session
+    def get(self, url, params=None, stream=False):
+        return self.session.get(url, params=params, stream=stream, timeout=self.timeout)
+
+    # Function to download a URL and return its body as bytes (releases the connection to the pool)
+    def get_bytes(self, url):
+        response = self.get(url)
+        response.raise_for_status()
+        return response.content
+
+    # Function to get the body size of a response as transferred, before any gzip decoding
+    # Uses Content-Length, else the bytes urllib3 read from the socket (chunked responses), else the body size
+    @staticmethod
+    def wire_bytes(response):
+        length = response.headers.get("Content-Length")
+        if length is not None and length.isdigit():
+            return int(length)
+        try:
+            return response.raw.tell()
+        except (AttributeError, OSError):
+            return len(response.content)
+
+    # Function to close every pooled connection
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+# -------------------------------------------------------------------------------------
+# Create a class for a response from ReplayTransport (the parts of requests.Response the app uses)
+class ReplayResponse:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content  # Body as bytes
+        self.headers = {"Content-Length": str(len(content))}
+
+    def json(self):
+        return json_loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise ConnectionError(f"HTTP {self.status_code}")
+
+
+# Create a class for an offline backend with the same interface as HTTPTransport
+# Answers /weather, /forecast, /group and icon requests from recorded fixture files
+# ({fixtures}/weather/london.json, {fixtures}/icons/10d.png, ...), else from synthetic payloads,
+# after an injected latency and with an injected error rate. With an upstream transport, missing
+# fixtures are fetched from it and recorded instead.
+class ReplayTransport:
+    def __init__(self, fixtures=None, latency=0.0, error_rate=0.0, upstream=None, seed=None):
+        self.fixtures = fixtures  # Fixture folder, or None for synthetic payloads only
+        self.latency = latency  # Seconds added to every request
+        self.error_rate = error_rate  # Share of requests answered with HTTP 503
+        self.upstream = upstream
+        self.calls = Counter()  # Requests served, by endpoint ("weather", "forecast", "group", "icon")
+        self.bytes = 0  # Response bytes served
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._icons = {}  # Synthetic PNGs by icon id
+
+    # Function to answer a GET request like HTTPTransport.get
+    def get(self, url, params=None, stream=False):
+        params = params or {}
+        if url.startswith(ICON_URL.split("{", 1)[0]):
+            endpoint, name = "icon", url.rsplit("/", 1)[-1].split("@", 1)[0]
+        else:
+            endpoint, name = url.rsplit("/", 1)[-1], self.fixture_name(params)
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[endpoint] += 1
+            failed = self._random.random() < self.error_rate
+        if failed:
+            content, status = b'{"cod": 503, "message": "Injected error"}', 503
+        else:
+            content, status = self._content(url, params, endpoint, name)
+        with self._lock:
+            self.bytes += len(content)
+        return ReplayResponse(status, content)
+
+    # Function to download a URL and return its body as bytes, like HTTPTransport.get_bytes
+    def get_bytes(self, url):
+        response = self.get(url)
+        response.raise_for_status()
+        return response.content
+
+    def close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+
+    # Function to get the fixture file name for a request ({"q": "New York"} -> "new-york")
+    @staticmethod
+    def fixture_name(params):
+        if "q" in params:
+            return re.sub(r"[^a-z0-9]+", "-", fold_name(str(params["q"]))).strip("-") or "city"
+        if "id" in params:
+            return str(params["id"]).replace(",", "_")
+        return f"{float(params.get('lat', 0)):.2f}_{float(params.get('lon', 0)):.2f}"
+
+    # Function to get a response body from a fixture, the upstream (recording it) or a synthetic payload
+    def _content(self, url, params, endpoint, name):
+        path = None
+        if self.fixtures is not None:
+            path = os.path.join(self.fixtures, "icons" if endpoint == "icon" else endpoint,
+                                f"{name}.png" if endpoint == "icon" else f"{name}.json")
+            try:
+                with open(path, "rb") as file:
+                    return file.read(), 200
+            except OSError:
+                pass
+        if self.upstream is not None:
+            response = self.upstream.get(url, params=params)
+            if response.status_code == 200 and path is not None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as file:
+                    file.write(response.content)
+            return response.content, response.status_code
+        if endpoint == "icon":
+            return self._icon(name), 200
+        payload = self.synthetic(endpoint, params)
+        if payload is None:
+            return json.dumps({"cod": "404", "message": "Not found"}).encode("utf-8"), 404
+        return json.dumps(payload).encode("utf-8"), 200
+
+    # Function to make a plausible payload for an endpoint, the same for a given city every time
+    # Observations change every 10 minutes like OpenWeatherMap's, temperatures follow params["units"]
+    @classmethod
+    def synthetic(cls, endpoint, params):
+        if endpoint == "group":
+            items = [cls.synthetic("weather", {"id": city_id, "units": params.get("units")})
+                     for city_id in str(params.get("id", "")).split(",") if city_id]
+            for item in items:
+                item.pop("timezone")  # /group items carry no timezone
+            return {"cnt": len(items), "list": items}
+        if endpoint not in ("weather", "forecast"):
+            return None
+        name = str(params.get("q", f"City {params.get('id', cls.fixture_name(params))}"))
+        seed = zlib.crc32(fold_name(name).encode("utf-8"))
+        city_id = int(params["id"]) if "id" in params else seed % 10 ** 7
+        lat = float(params["lat"]) if "lat" in params else seed % 12000 / 100 - 60
+        lon = float(params["lon"]) if "lon" in params else seed // 12000 % 36000 / 100 - 180
+        timezone_offset = round(lon / 15) * 3600
+        offset = 0 if params.get("units") in ("metric", "imperial") else 273.15  # Kelvin by default, like OWM
+        scale = 9 / 5 if params.get("units") == "imperial" else 1
+        base = 5 + seed % 25
+        icons = ("01d", "02d", "03d", "04d", "09d", "10d", "11d", "13d", "50d")
+        descriptions = ("clear sky", "few clouds", "scattered clouds", "broken clouds", "shower rain", "rain",
+                        "thunderstorm", "snow", "mist")
+
+        def slot(dt):
+            local_hour = (dt + timezone_offset) % 86400 / 3600
+            celsius = base + 6 * math.sin((local_hour - 9) / 24 * 2 * math.pi)
+            temperature = round(celsius * scale + (32 if scale != 1 else 0) + offset, 2)
+            condition = (seed + dt // 10800) % len(icons)
+            return {"dt": dt,
+                    "main": {"temp": temperature, "feels_like": round(temperature - scale, 2), "temp_min": round(temperature - scale, 2),
+                             "temp_max": round(temperature + scale, 2), "pressure": 1000 + seed % 30, "humidity": 40 + seed % 50},
+                    "weather": [{"id": 800, "main": descriptions[condition].title(), "description": descriptions[condition],
+                                 "icon": icons[condition]}],
+                    "wind": {"speed": round(1 + seed % 90 / 10, 1), "deg": (seed + dt // 3600) % 360},
+                    "clouds": {"all": seed % 100}, "visibility": 10000, "pop": seed % 10 / 10}
+
+        now = int(time.time())
+        if endpoint == "weather":
+            payload = slot(now // 600 * 600)
+            payload.update({"coord": {"lat": lat, "lon": lon}, "sys": {"country": "XX"}, "timezone": timezone_offset,
+                            "id": city_id, "name": name, "cod": 200})
+            return payload
+        count = min(int(params.get("cnt", 40)), 40)
+        first = now // 10800 * 10800 + 10800
+        return {"cod": "200", "cnt": count, "list": [slot(first + i * 10800) for i in range(count)],
+                "city": {"id": city_id, "name": name, "coord": {"lat": lat, "lon": lon}, "country": "XX",
+                         "timezone": timezone_offset}}
+
+    # Function to get a synthetic icon, a square in a colour of its own
+    def _icon(self, icon_id):
+        with self._lock:
+            data = self._icons.get(icon_id)
+        if data is None:
+            seed = zlib.crc32(icon_id.encode("ascii"))
+            output = io.BytesIO()
+            Image.new("RGBA", (100, 100), (seed % 256, seed // 256 % 256, seed // 65536 % 256, 255)).save(output, "PNG")
+            data = output.getvalue()
+            with self._lock:
+                self._icons[icon_id] = data
+        return data
+# -------------------------------------------------------------------------------------
+# Create a class for a client-side rate limiter (token bucket)
+# Calls in any 60 s window never exceed burst + rate_per_minute, so keep their sum under the OWM quota
+class TokenBucket:
+    def __init__(self, rate_per_minute=55, burst=5):
+        self.rate = rate_per_minute / 60.0  # Tokens added per second
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Function to take one token, sleeping until one is available
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+# Create a class to count API calls over a sliding window (quota usage)
+class CallCounter:
+    def __init__(self, window=60):
+        self.window = window  # Seconds counted
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    # Function to record one call
+    def add(self):
+        with self._lock:
+            self._times.append(time.monotonic())
+
+    # Function to get the number of calls made in the last window
+    def count(self):
+        with self._lock:
+            oldest = time.monotonic() - self.window
+            while self._times and self._times[0] < oldest:
+                self._times.popleft()
+            return len(self._times)
+# -------------------------------------------------------------------------------------
+# Function to fold a city name for matching ("São Paulo " -> "sao paulo")
+def fold_name(name):
+    decomposed = unicodedata.normalize("NFKD", name)
+    return " ".join("".join(char for char in decomposed if not unicodedata.combining(char)).lower().split())
+
+
+# Create a class for the offline city index (prefix and trigram search, name -> city id/coordinates)
+# Rows are sorted by folded name, so a prefix search is a binary search plus a short scan
+class CityIndex:
+    VERSION = 2  # Bump when the saved file layout or row selection changes
+
+    def __init__(self, names, countries, ids, lats, lons, trigrams=None):
+        self.names = names  # Display names
+        self.countries = countries  # Country codes ("" when unknown)
+        self.ids = ids  # array of OpenWeatherMap city ids (-1 when unknown)
+        self.lats = lats  # array of latitudes (nan when unknown)
+        self.lons = lons
+        self.keys = [fold_name(name) for name in names]
+        self._trigrams = trigrams  # Trigram -> array of rows, built on first fuzzy search
+        self._rows_by_label = None
+
+    # Function to build an index from rows of (name, country, id, lat, lon), sorting and de-duplicating them
+    # Rows with an id are unique per id, so same-name cities of one country are all kept
+    @classmethod
+    def from_rows(cls, rows):
+        unique = {}
+        for name, country, city_id, lat, lon in rows:
+            unique.setdefault((fold_name(name), country, city_id if city_id >= 0 else -1), (name, country, city_id, lat, lon))
+        ordered = [unique[key] for key in sorted(unique)]
+        return cls([row[0] for row in ordered], [row[1] for row in ordered], array("q", [row[2] for row in ordered]),
+                   array("d", [row[3] for row in ordered]), array("d", [row[4] for row in ordered]))
+
+    # Function to build an index from plain city names (no ids or coordinates, queries fall back to the name)
+    @classmethod
+    def from_names(cls, names):
+        return cls.from_rows((name, "", -1, float("nan"), float("nan")) for name in names)
+
+    # Function to build an index from the OpenWeatherMap city list (city.list.json or city.list.json.gz)
+    @classmethod
+    def from_owm_catalogue(cls, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as file:
+            catalogue = json.load(file)
+        return cls.from_rows((city["name"], city.get("country", ""), city["id"], city["coord"]["lat"], city["coord"]["lon"])
+                             for city in catalogue if city.get("name"))
+
+    # Function to save the index as one compact binary file (trigrams included, so loading does no work)
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        payload = {"version": self.VERSION, "names": self.names, "countries": self.countries, "ids": self.ids,
+                   "lats": self.lats, "lons": self.lons, "trigrams": self.trigrams}
+        with open(path, "wb") as file:
+            pickle.dump(payload, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Function to load an index written by save()
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            payload = pickle.load(file)
+        if payload.get("version") != cls.VERSION:
+            raise ValueError(f"Unsupported city index version in {path}")
+        return cls(payload["names"], payload["countries"], payload["ids"], payload["lats"], payload["lons"], payload["trigrams"])
+
+    # Function to load the saved index from the cache folder, building it from city.list.json.gz if needed
+    # Returns None when neither file exists
+    @classmethod
+    def load_default(cls, directory=CACHE_DIR):
+        index_path = os.path.join(directory, "cities.idx")
+        catalogue_path = os.path.join(directory, "city.list.json.gz")
+        if os.path.exists(index_path):
+            try:
+                return cls.load(index_path)
+            except ValueError:
+                pass  # Written by an older version, rebuilt from the catalogue below
+        if os.path.exists(catalogue_path):
+            index = cls.from_owm_catalogue(catalogue_path)
+            index.save(index_path)
+            return index
+        return None
+
+    def __len__(self):
+        return len(self.names)
+
+    # Function to get the text shown in the dropdown for a row ("London, GB")
+    def label(self, row):
+        return f"{self.names[row]}, {self.countries[row]}" if self.countries[row] else self.names[row]
+
+    # Trigram -> rows, built once (about a second for the full catalogue, then saved with the index)
+    @property
+    def trigrams(self):
+        if self._trigrams is None:
+            postings = {}
+            for row, key in enumerate(self.keys):
+                for trigram in self._key_trigrams(key):
+                    postings.setdefault(trigram, []).append(row)
+            self._trigrams = {trigram: array("I", rows) for trigram, rows in postings.items()}
+        return self._trigrams
+
+    # Function to split a folded name into its set of padded trigrams
+    @staticmethod
+    def _key_trigrams(key):
+        padded = f"  {key} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    # Function to get up to `limit` rows whose name starts with the (folded) prefix
+    def prefix_rows(self, prefix, limit=20):
+        rows = []
+        row = bisect.bisect_left(self.keys, prefix)
+        while row < len(self.keys) and len(rows) < limit and self.keys[row].startswith(prefix):
+            rows.append(row)
+            row += 1
+        return rows
+
+    # Function to get up to `limit` rows that share the most trigrams with the query (typos, mid-word matches)
+    # Candidates come from the rarest query trigrams only, capped, so common ones like " sa" stay cheap
+    def fuzzy_rows(self, query, limit=20, probes=2, max_candidates=150):
+        query_trigrams = self._key_trigrams(query)
+        postings = sorted((self.trigrams[trigram] for trigram in query_trigrams if trigram in self.trigrams), key=len)
+        candidates = set()
+        for rows in postings[:probes]:
+            candidates.update(rows[:max_candidates])
+        scored = []
+        for row in candidates:
+            padded = f"  {self.keys[row]} "
+            score = sum(trigram in padded for trigram in query_trigrams)
+            scored.append((-score, abs(len(self.keys[row]) - len(query)), row))
+        scored.sort()
+        return [row for score, length_gap, row in scored[:limit]]
+
+    # Function to get dropdown suggestions for what has been typed so far
+    def complete(self, text, limit=20):
+        query = fold_name(text)
+        if not query:
+            return []
+        rows = self.prefix_rows(query, limit)
+        if len(rows) < limit and len(query) >= 3:
+            seen = set(rows)
+            rows += [row for row in self.fuzzy_rows(query, limit) if row not in seen][:limit - len(rows)]
+        return [self.label(row) for row in rows]
+
+    # Function to find the row for a name or dropdown label ("London" or "London, GB"), or None
+    # Returns None when several cities match (a bare "London" is in GB, CA and US), so the caller
+    # falls back to OpenWeatherMap's own name search instead of picking one at random
+    def lookup(self, text):
+        if self._rows_by_label is None:
+            by_label = {}
+            for row in range(len(self.names)):
+                for key in {fold_name(self.label(row)), self.keys[row]}:
+                    by_label[key] = row if key not in by_label else None  # None marks an ambiguous name
+            self._rows_by_label = by_label
+        return self._rows_by_label.get(fold_name(text))
+# -------------------------------------------------------------------------------------
+# Create a class to remember each city's UTC offset between runs, so local time needs no request
+# Offsets older than revalidate_after are still used, but flagged so the caller can refresh them (DST changes)
+class TimezoneStore:
+    def __init__(self, path=os.path.join(CACHE_DIR, "timezones.json"), revalidate_after=6 * 3600, save_interval=300):
+        self.path = path
+        self.revalidate_after = revalidate_after
+        self.save_interval = save_interval  # Seconds between writes when only check times changed
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # One writer at a time, so an older snapshot never replaces a newer file
+        self._saved_at = time.time()
+        self._dirty = False
+        try:
+            with open(path, encoding="utf-8") as file:
+                self._offsets = json.load(file)  # city -> [offset seconds, time last confirmed]
+        except (OSError, ValueError):
+            self._offsets = {}
+
+    # Function to get a city's offset, returns (offset, is_fresh) or None if unknown
+    def get(self, city):
+        with self._lock:
+            entry = self._offsets.get(city)
+        if entry is None:
+            return None
+        offset, checked_at = entry
+        return offset, time.time() - checked_at < self.revalidate_after
+
+    # Function to record an offset seen in a response
+    def set(self, city, offset):
+        with self._lock:
+            previous = self._offsets.get(city)
+            self._offsets[city] = [offset, time.time()]
+            self._dirty = True
+            changed = previous is None or previous[0] != offset
+        if changed or time.time() - self._saved_at > self.save_interval:
+            self.save()
+
+    # Function to write the offsets to disk if anything changed
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                offsets = dict(self._offsets)
+                self._dirty = False
+                self._saved_at = time.time()
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                temp_path = f"{self.path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as file:
+                    json.dump(offsets, file)
+                os.replace(temp_path, self.path)
+            except OSError:
+                pass  # Offsets are only a shortcut, they are learned again from the next response
+# -------------------------------------------------------------------------------------
+# Create a class for a parsed /forecast response, stored column by column in NumPy arrays
+# One row per 3-hour slot, temperatures in °C, times as UNIX timestamps
+class ForecastTable:
+    NUMERIC_COLUMNS = ("timestamps", "temperature", "feels_like", "temp_min", "temp_max", "humidity", "pressure",
+                       "wind_speed", "wind_direction", "clouds", "pop")
+
+    def __init__(self, columns, icons, descriptions, timezone_offset=0):
+        for name in self.NUMERIC_COLUMNS:
+            setattr(self, name, columns[name])
+        self.icons = icons  # Array of icon ids
+        self.descriptions = descriptions  # Array of weather descriptions
+        self.timezone_offset = timezone_offset  # City's UTC offset in seconds, used for local dates
+
+    # Function to parse a /forecast payload (requested in °C) once into columns
+    @classmethod
+    def from_payload(cls, forecast_data):
+        slots = forecast_data.get("list", [])
+        rows = np.array([(slot["dt"], slot["main"]["temp"], slot["main"]["feels_like"], slot["main"].get("temp_min", slot["main"]["temp"]),
+                          slot["main"].get("temp_max", slot["main"]["temp"]), slot["main"]["humidity"], slot["main"]["pressure"],
+                          slot.get("wind", {}).get("speed", np.nan), slot.get("wind", {}).get("deg", np.nan),
+                          slot.get("clouds", {}).get("all", np.nan), slot.get("pop", np.nan)) for slot in slots],
+                        dtype=float).reshape(len(slots), len(cls.NUMERIC_COLUMNS))
+        columns = dict(zip(cls.NUMERIC_COLUMNS, rows.T.copy()))
+        columns["timestamps"] = columns["timestamps"].astype(np.int64)
+        icons = np.array([slot["weather"][0]["icon"] for slot in slots], dtype=object)
+        descriptions = np.array([slot["weather"][0]["description"] for slot in slots], dtype=object)
+        return cls(columns, icons, descriptions, forecast_data.get("city", {}).get("timezone", 0))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # Function to get the first `count` slots as a new table (array views, nothing is copied)
+    def head(self, count):
+        columns = {name: getattr(self, name)[:count] for name in self.NUMERIC_COLUMNS}
+        return ForecastTable(columns, self.icons[:count], self.descriptions[:count], self.timezone_offset)
+
+    # Function to convert °C values (a number or a whole array) to °F
+    @staticmethod
+    def to_fahrenheit(values):
+        return values * 9 / 5 + 32
+
+    # Function to aggregate the slots per local calendar day of the city
+    # Returns a dict of per-day arrays: day (days since epoch), temp_min, temp_max, temperature (mean),
+    # humidity (mean), icons and descriptions (of the slot closest to local noon)
+    def daily(self):
+        if len(self) == 0:
+            return {"day": np.array([], dtype=np.int64), "temp_min": np.array([]), "temp_max": np.array([]),
+                    "temperature": np.array([]), "humidity": np.array([]), "icons": self.icons, "descriptions": self.descriptions}
+        local_seconds = self.timestamps + self.timezone_offset
+        days = local_seconds // 86400
+        # Slots arrive in time order, so each day is one contiguous run starting at `starts`
+        day, starts, counts = np.unique(days, return_index=True, return_counts=True)
+        noon_distance = np.abs(local_seconds % 86400 - 12 * 3600)
+        noon_rows = np.array([start + np.argmin(noon_distance[start:start + count]) for start, count in zip(starts, counts)])
+        return {
+            "day": day,
+            "temp_min": np.minimum.reduceat(np.fmin(self.temp_min, self.temperature), starts),
+            "temp_max": np.maximum.reduceat(np.fmax(self.temp_max, self.temperature), starts),
+            "temperature": np.add.reduceat(self.temperature, starts) / counts,
+            "humidity": np.add.reduceat(self.humidity, starts) / counts,
+            "icons": self.icons[noon_rows],
+            "descriptions": self.descriptions[noon_rows],
+        }
+# -------------------------------------------------------------------------------------
+# Create a class for the current weather of a city, decoded straight from a /weather payload (°C, m/s)
+# timestamps and hourly_temperatures are only filled when the hourly forecast was requested with it
+class CurrentWeather:
+    __slots__ = ("icon_url", "temperature", "feels_like", "description", "city", "country", "wind_speed", "wind_direction",
+                 "pressure", "humidity", "dew_point", "visibility", "lat", "lon", "timestamps", "hourly_temperatures")
+
+    def __init__(self, current_weather, forecast_table=None):
+        main = current_weather['main']
+        self.icon_url = ICON_URL.format(icon_id=current_weather['weather'][0]['icon'])
+        self.temperature = main['temp']
+        self.feels_like = main['feels_like']
+        self.description = current_weather['weather'][0]['description']
+        self.city = current_weather['name']
+        self.country = current_weather['sys']['country']
+        self.wind_speed = current_weather['wind']['speed']
+        self.wind_direction = current_weather['wind']['deg']
+        self.pressure = main['pressure']
+        self.humidity = main['humidity']
+        self.dew_point = self.temperature - (100 - self.humidity) / 5
+        self.visibility = current_weather.get('visibility', "N/A")
+        self.lat = current_weather['coord']['lat']
+        self.lon = current_weather['coord']['lon']
+        self.timestamps = None if forecast_table is None else forecast_table.timestamps
+        self.hourly_temperatures = None if forecast_table is None else forecast_table.temperature
+# -------------------------------------------------------------------------------------
+# Create a class for the local history of every observation and forecast snapshot (SQLite)
+# Writes are queued and committed in batches by one background thread, so callers never wait on disk
+class HistoryStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS observations (
+            city TEXT NOT NULL, dt INTEGER NOT NULL, fetched_at INTEGER NOT NULL,
+            temperature REAL, feels_like REAL, humidity REAL, pressure REAL,
+            wind_speed REAL, wind_direction REAL, description TEXT,
+            PRIMARY KEY (city, dt)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS forecasts (
+            city TEXT NOT NULL, issued_at INTEGER NOT NULL, dt INTEGER NOT NULL,
+            temperature REAL, feels_like REAL, humidity REAL, pressure REAL,
+            wind_speed REAL, wind_direction REAL, pop REAL, description TEXT,
+            PRIMARY KEY (city, issued_at, dt)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS forecasts_by_target ON forecasts (city, dt);
+        CREATE TABLE IF NOT EXISTS observations_hourly (
+            city TEXT NOT NULL, hour INTEGER NOT NULL, count INTEGER NOT NULL,
+            temperature_sum REAL, temperature_min REAL, temperature_max REAL,
+            humidity_sum REAL, wind_speed_sum REAL, wind_count INTEGER,
+            PRIMARY KEY (city, hour)
+        ) WITHOUT ROWID;
+    """
+    # Hourly rollup kept in step with observations, so long trends read one row per hour
+    ROLLUP = """
+        INSERT INTO observations_hourly VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (city, hour) DO UPDATE SET
+            count = count + 1,
+            temperature_sum = temperature_sum + excluded.temperature_sum,
+            temperature_min = MIN(temperature_min, excluded.temperature_min),
+            temperature_max = MAX(temperature_max, excluded.temperature_max),
+            humidity_sum = humidity_sum + excluded.humidity_sum,
+            wind_speed_sum = wind_speed_sum + excluded.wind_speed_sum,
+            wind_count = wind_count + excluded.wind_count
+    """
+
+    def __init__(self, path=os.path.join(CACHE_DIR, "history.sqlite3"), batch_size=500, flush_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size  # Most payloads written per transaction
+        self.flush_interval = flush_interval  # Seconds the writer waits to fill a batch
+        self._queue = queue.Queue()
+        self._local = threading.local()  # One read connection per thread
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(self.SCHEMA)
+        self._writer = threading.Thread(target=self._run, name="weatherwise-history", daemon=True)
+        self._writer.start()
+
+    # Function to open a connection tuned for one writer and many readers
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    # Function to queue a /weather or /forecast payload for a city (returns at once, any thread)
+    def record(self, endpoint, city, data, fetched_at=None):
+        self._queue.put(("record", endpoint, city, data, int(fetched_at or time.time())))
+
+    # Function to wait until everything queued so far has been written
+    def flush(self, timeout=10):
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        return done.wait(timeout)
+
+    # Function to write what is queued and stop the writer
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+
+    # Function for the writer thread: gather a batch, write it in one transaction, repeat
+    def _run(self):
+        connection = self._connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and item[0] != "flush":
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # Stop after writing this batch
+                    break
+                batch.append(item)
+            self._write(connection, batch)
+        connection.close()
+
+    # Function to turn a batch of payloads into rows and insert them
+    def _write(self, connection, batch):
+        observations, forecasts, flushed = [], [], []
+        for item in batch:
+            if item[0] == "flush":
+                flushed.append(item[1])
+                continue
+            endpoint, city, data, fetched_at = item[1:]
+            try:
+                if endpoint == "weather":
+                    observations.append(self._observation_row(city, data, fetched_at))
+                elif endpoint == "forecast":
+                    forecasts.extend(self._forecast_rows(city, data, fetched_at))
+            except (KeyError, IndexError, TypeError):
+                pass  # Skip payloads missing the fields we store
+        try:
+            with connection:
+                rollup = []
+                for row in observations:
+                    # Observations already stored (same city and dt) are skipped, and not counted twice in the rollup
+                    if connection.execute("INSERT OR IGNORE INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row).rowcount:
+                        city, dt, temperature, humidity, wind_speed = row[0], row[1], row[3], row[5], row[7]
+                        rollup.append((city, dt - dt % 3600, temperature, temperature, temperature, humidity,
+                                       wind_speed or 0, int(wind_speed is not None)))
+                connection.executemany(self.ROLLUP, rollup)
+                connection.executemany("INSERT OR IGNORE INTO forecasts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", forecasts)
+        except sqlite3.Error:
+            pass  # History is best effort, the app keeps working without it
+        for done in flushed:
+            done.set()
+
+    # Function to get an observations row from a /weather payload (temperatures in °C)
+    @staticmethod
+    def _observation_row(city, data, fetched_at):
+        main, wind = data["main"], data.get("wind", {})
+        return (city, data["dt"], fetched_at, main["temp"], main["feels_like"], main["humidity"],
+                main["pressure"], wind.get("speed"), wind.get("deg"), data["weather"][0]["description"])
+
+    # Function to get forecasts rows from a /forecast payload (temperatures in °C)
+    @staticmethod
+    def _forecast_rows(city, data, fetched_at):
+        return [(city, fetched_at, slot["dt"], slot["main"]["temp"], slot["main"]["feels_like"],
+                 slot["main"]["humidity"], slot["main"]["pressure"], slot.get("wind", {}).get("speed"),
+                 slot.get("wind", {}).get("deg"), slot.get("pop"), slot["weather"][0]["description"])
+                for slot in data["list"]]
+
+    # Function to get this thread's read connection
+    def _reader(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    # Function to get a city's observations between two UNIX times, oldest first
+    def observations(self, city, start, end):
+        return self._reader().execute(
+            "SELECT dt, temperature, feels_like, humidity, pressure, wind_speed, wind_direction, description "
+            "FROM observations WHERE city = ? AND dt BETWEEN ? AND ? ORDER BY dt", (city, start, end)).fetchall()
+
+    # Function to downsample a city's observations into buckets of `bucket` seconds
+    # Returns rows of (bucket start, mean temperature, min, max, mean humidity, mean wind speed, count)
+    # Whole-hour buckets are read from the hourly rollup (the hours at both ends are then counted whole)
+    def trend(self, city, start, end, bucket=3600):
+        if bucket % 3600 == 0:
+            return self._reader().execute(
+                "SELECT (hour / ?) * ? AS bucket_start, SUM(temperature_sum) / SUM(count), MIN(temperature_min), "
+                "MAX(temperature_max), SUM(humidity_sum) / SUM(count), SUM(wind_speed_sum) / NULLIF(SUM(wind_count), 0), "
+                "SUM(count) FROM observations_hourly WHERE city = ? AND hour BETWEEN ? AND ? "
+                "GROUP BY bucket_start ORDER BY bucket_start", (bucket, bucket, city, start - start % 3600, end)).fetchall()
+        return self._reader().execute(
+            "SELECT (dt / ?) * ? AS bucket_start, AVG(temperature), MIN(temperature), MAX(temperature), "
+            "AVG(humidity), AVG(wind_speed), COUNT(*) FROM observations "
+            "WHERE city = ? AND dt BETWEEN ? AND ? GROUP BY bucket_start ORDER BY bucket_start",
+            (bucket, bucket, city, start, end)).fetchall()
+
+    # Function to compare past forecasts with what was then observed
+    # Returns rows of (target time, lead time in seconds, forecast temperature, observed temperature), each
+    # forecast slot matched with the mean of the observations within `window` seconds of it
+    def forecast_accuracy(self, city, start, end, window=5400):
+        return self._reader().execute(
+            "SELECT f.dt, f.dt - f.issued_at, f.temperature, AVG(o.temperature) FROM forecasts AS f "
+            "JOIN observations AS o ON o.city = f.city AND o.dt BETWEEN f.dt - ? AND f.dt + ? "
+            "WHERE f.city = ? AND f.dt BETWEEN ? AND ? GROUP BY f.issued_at, f.dt ORDER BY f.dt, f.issued_at",
+            (window, window, city, start, end)).fetchall()
 # -------------------------------------------------------------------------------------
 # Create a class 
 class WeatherAPI:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache_ttl=600, cache_stale_ttl=1800, cache_size=128, transport=None, max_workers=4,
+                 rate_limiter=None, city_index=None, timezones=None, history=None):
         self.api_key = api_key
-    # Get weather function (information of current and hourly forecast from OpenWeatherMap API)
-    def get_weather(self, city):
+        # Optional TokenBucket, every request that goes out to OpenWeatherMap takes a token first
+        self.rate_limiter = rate_limiter
+        # OpenWeatherMap city ids learned from responses, by normalized city name
+        self.city_ids = {}
+        # Optional CityIndex used to query by city id/coordinates instead of by free-text name
+        self.city_index = city_index
+        # UTC offsets captured from every response, used by get_current_time
+        self.timezones = timezones if timezones is not None else TimezoneStore()
+        # Parsed ForecastTable per city, reused while the cached /forecast payload is unchanged
+        # Bounded like the response cache, least recently used tables are dropped first
+        self._tables = OrderedDict()
+        self._tables_size = cache_size
+        self._tables_lock = threading.Lock()
+        # Optional HistoryStore that keeps every payload fetched from OpenWeatherMap
+        self.history = history
+        # API calls made in the last minute, compared with the plan's quota
+        self.calls = CallCounter()
+        METRICS.gauge("quota.calls_last_minute", self.calls.count)
+        # One transport shared by every API call and icon download
+        self.transport = transport or HTTPTransport()
+        # Responses keyed by (endpoint, normalized city), shared by every view of the app
+        self.cache = ResponseCache(cache_ttl, cache_stale_ttl, cache_size)
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        # Worker threads for concurrent fetches and background revalidation
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="weatherapi")
+        # Function used to report errors, the app replaces it with a thread-safe version
+        self.show_error = messagebox.showerror
+    # -------------------------------------------------------------------------------------
+    # Function to normalize a city name so "london", " London " and "LONDON" share a cache entry
+    @staticmethod
+    def normalize_city(city):
+        return " ".join(city.split()).lower()
+
+    # Function to get the OpenWeatherMap id for a city name or dropdown label, or None
+    def city_id(self, city):
+        city_id = self.city_ids.get(self.normalize_city(city))
+        if city_id is None and self.city_index is not None:
+            row = self.city_index.lookup(city)
+            if row is not None and self.city_index.ids[row] >= 0:
+                city_id = self.city_index.ids[row]
+        return city_id
+
+    # Function to get the query parameters locating a city: its id, else its coordinates, else its name
+    def location_params(self, city):
+        city_id = self.city_id(city)
+        if city_id is not None:
+            return {"id": city_id}
+        if self.city_index is not None:
+            row = self.city_index.lookup(city)
+            if row is not None and self.city_index.lats[row] == self.city_index.lats[row]:  # Skip nan coordinates
+                return {"lat": self.city_index.lats[row], "lon": self.city_index.lons[row]}
+        return {"q": city}
+
+    # Function to get an endpoint for a city, returns (status_code, json data)
+    # Fresh cache entries cost no HTTP call, stale ones are returned at once and refreshed in the background
+    # force=True skips the cache and always asks OpenWeatherMap, count asks /forecast for only its first slots
+    def fetch(self, endpoint, city, force=False, count=None):
+        key = self.resolve_key(self.cache_key(endpoint, city, count))
+        cached = None if force else self.lookup(key)
+        if cached is not None:
+            data, is_fresh = cached
+            if not is_fresh:
+                self._revalidate(endpoint, city, key)
+            return 200, data
+        return self._fetch_and_store(endpoint, city, key)
+
+    # Function to get the cache key of a request, count is the number of forecast slots asked for (None: all of them)
+    def cache_key(self, endpoint, city, count=None):
+        return (endpoint, self.normalize_city(city), count)
+
+    # Function to get the cache key that answers a request
+    # A cached complete forecast (even a stale one, which is then refreshed as a whole) answers a request
+    # for its first slots, so a city never holds a complete and a partial forecast fetched separately
+    def resolve_key(self, key):
+        if key[2] is not None and self.cache.get(key[:2] + (None,), counted=False) is not None:
+            return key[:2] + (None,)
+        return key
+
+    # Function to look up a cache key, returns (data, is_fresh) or None, counted as one lookup
+    def lookup(self, key, counted=True):
+        cached = self.cache.get(self.resolve_key(key), counted=False)
+        if counted:
+            self.cache.count_lookup(cached)
+        return cached
+
+    # Function to get the cached payload of an endpoint for a city without any HTTP call, or None
+    def cached(self, endpoint, city):
+        cached = self.lookup(self.cache_key(endpoint, city), counted=False)  # A peek, not a view's lookup
+        return None if cached is None else cached[0]
+
+    # Function to fetch several (endpoint, city, count) requests concurrently, returns their results in order
+    # Waits for the slowest request, then re-raises the first error so no failure is swallowed
+    def fetch_many(self, targets):
+        futures = [self.executor.submit(self.fetch, endpoint, city, False, count) for endpoint, city, count in targets]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    # Function to request an endpoint from OpenWeatherMap and cache successful responses
+    def _fetch_and_store(self, endpoint, city, key):
+        params = self.location_params(city)
+        if key[2] is not None:
+            params["cnt"] = key[2]
+        status, data = self._request(endpoint, params)
+        if status == 200:
+            self.cache.set(key, data)
+            if endpoint == "weather" and "id" in data:
+                self.city_ids[key[1]] = data["id"]
+            self._capture_timezone(key[1], data)
+            if self.history is not None:
+                self.history.record(endpoint, key[1], data)
+        return status, data
+
+    # Function to send one request to OpenWeatherMap, returns (status_code, json data)
+    def _request(self, endpoint, params):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        params["units"] = UNITS
+        params["appid"] = self.api_key
+        self.calls.add()
+        with METRICS.stage(f"http.{endpoint}"):
+            response = self.transport.get(f"{BASE_URL}/{endpoint}", params=params)
+        if METRICS.enabled:
+            METRICS.count(f"requests.{endpoint}")
+            METRICS.count(f"bytes.{endpoint}", HTTPTransport.wire_bytes(response))
+        with METRICS.stage(f"json.{endpoint}"):
+            return response.status_code, json_loads(response.content)
+
+    # Function to keep the UTC offset found in a /weather or /forecast payload
+    def _capture_timezone(self, city, data):
+        offset = data.get("timezone", data.get("city", {}).get("timezone"))
+        if offset is not None:
+            self.timezones.set(city, offset)
+
+    # Function to get current weather for up to 20 city ids in one request, returns (status_code, json data)
+    def fetch_group(self, city_ids):
+        return self._request("group", {"id": ",".join(str(city_id) for city_id in city_ids)})
+
+    # Function to refresh a stale cache entry once, in a background thread
+    # Returns True when a request was started, False when one is already in progress
+    def _revalidate(self, endpoint, city, key):
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._fetch_and_store(endpoint, city, key)
+            except Exception:
+                pass  # Keep serving the stale entry, the next lookup will try again
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        self.executor.submit(refresh)
+        return True
+    # Function to turn a /forecast payload into a ForecastTable, parsing each payload only once
+    # Complete and hourly-only payloads of a city are kept apart, so switching views does not re-parse
+    def forecast_table(self, city, forecast_data):
+        key = (self.normalize_city(city), forecast_data.get("cnt"))
+        with self._tables_lock:
+            parsed = self._tables.get(key)
+            if parsed is not None:
+                self._tables.move_to_end(key)
+        if parsed is None or parsed[0] is not forecast_data:
+            with METRICS.stage("parse.forecast"):
+                parsed = (forecast_data, ForecastTable.from_payload(forecast_data))
+            with self._tables_lock:
+                self._tables[key] = parsed
+                self._tables.move_to_end(key)
+                while len(self._tables) > self._tables_size:
+                    self._tables.popitem(last=False)
+        return parsed[1]
+
+    # Function to get the forecast for a city as a ForecastTable, returns (status_code, table or json error data)
+    def get_forecast(self, city):
+        status, forecast_data = self.fetch("forecast", city)
+        if status != 200:
+            return status, forecast_data
+        return status, self.forecast_table(city, forecast_data)
+    # -------------------------------------------------------------------------------------
+    # Get weather function (information of current and hourly forecast from OpenWeatherMap API), returns a CurrentWeather
+    # The hourly forecast (its first HOURLY_SLOTS slots only) is requested along with it when hourly=True
+    def get_weather(self, city, hourly=False):
         try:
-            current_weather_url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={self.api_key}"
-            hourly_forecast_url = f"https://api.openweathermap.org/data/2.5/forecast?q={city}&appid={self.api_key}"
-
-            current_weather_res = requests.get(current_weather_url)
-            hourly_forecast_res = requests.get(hourly_forecast_url)
+            if hourly:
+                # Current weather and forecast are independent, so request both at once
+                (current_status, current_weather), (forecast_status, hourly_forecast) = self.fetch_many(
+                    [("weather", city, None), ("forecast", city, HOURLY_SLOTS)])
+            else:
+                (current_status, current_weather), forecast_status = self.fetch("weather", city), None
 
-            if current_weather_res.status_code == 404 or hourly_forecast_res.status_code == 404:
-                messagebox.showerror("Error", "City not found, please enter again.")
+            if current_status == 404 or forecast_status == 404:
+                self.show_error("Error", "City not found, please enter again.")
                 return
 
-            current_weather = current_weather_res.json()
-            if current_weather_res.status_code != 200:
-                error_message = current_weather_res.json().get('message', 'Unknown error')
-                messagebox.showerror("Error", f"Failed to retrieve weather information: {error_message}")
+            if current_status != 200:
+                error_message = current_weather.get('message', 'Unknown error')
+                self.show_error("Error", f"Failed to retrieve weather information: {error_message}")
                 return
 
-            icon_id = current_weather['weather'][0]['icon']
-            temperature = current_weather['main']['temp'] - 273.15
-            feels_like = current_weather['main']['feels_like'] - 273.15
-            description = current_weather['weather'][0]['description']
-            city = current_weather['name']
-            country = current_weather['sys']['country']
-            wind_speed = current_weather['wind']['speed']
-            wind_direction = current_weather['wind']['deg']
-            pressure = current_weather['main']['pressure']
-            humidity = current_weather['main']['humidity']
-            dew_point = temperature - (100 - humidity) / 5
-            visibility = current_weather.get('visibility', "N/A")
-
-            # Extract latitude and longitude
-            lat = current_weather['coord']['lat']
-            lon = current_weather['coord']['lon']
-
-            hourly_forecast = hourly_forecast_res.json()
-            hourly_temperatures = [forecast['main']['temp'] - 273.15 for forecast in hourly_forecast['list']]
-            timestamps = [forecast['dt'] for forecast in hourly_forecast['list']]
-
-            icon_url = f"https://openweathermap.org/img/wn/{icon_id}@2x.png"
-            return (icon_url, temperature, description, city, country, wind_speed, wind_direction, pressure,
-                    humidity, dew_point, visibility, feels_like, timestamps, hourly_temperatures, lat, lon)
+            forecast_table = None
+            if hourly:
+                if forecast_status != 200:
+                    error_message = hourly_forecast.get('message', 'Unknown error')
+                    self.show_error("Error", f"Failed to retrieve the hourly forecast: {error_message}")
+                    return
+                forecast_table = self.forecast_table(city, hourly_forecast).head(HOURLY_SLOTS)
+            return CurrentWeather(current_weather, forecast_table)
         except requests.exceptions.RequestException as e:
-            messagebox.showerror("Error", f"Request error: {e}")
+            self.show_error("Error", f"Request error: {e}")
             return None
         except KeyError as e:
-            messagebox.showerror("Error", f"Key error: {e}")
+            self.show_error("Error", f"Key error: {e}")
             return None
         except Exception as e:
-            messagebox.showerror("Error", f"An unexpected error occurred: {e}")
+            self.show_error("Error", f"An unexpected error occurred: {e}")
             return None
     # -------------------------------------------------------------------------------------
     # Function to get the current time for a city using OpenWeatherMap's data
     def get_current_time(self, city):
         try:
-            current_weather_url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={self.api_key}"
-
-            current_weather_res = requests.get(current_weather_url)
+            # Use the stored offset when there is one, a stale one is refreshed in the background
+            stored = self.timezones.get(self.normalize_city(city))
+            if stored is not None:
+                timezone_offset, is_fresh = stored
+                if not is_fresh:
+                    self.executor.submit(self._refresh_timezone, city)
+            else:
+                status, current_weather_data = self.fetch("weather", city)
 
-            if current_weather_res.status_code != 200:
-                return "Time not available"
+                if status != 200:
+                    return "Time not available"
 
-            current_weather_data = current_weather_res.json()
-            timezone_offset = current_weather_data["timezone"]
+                timezone_offset = current_weather_data["timezone"]
 
             # Calculate the local time based on the UTC time and timezone offset
             utc_time = datetime.utcnow()
@@ -90,45 +1255,46 @@ class WeatherAPI:
             return self.current_time
         except Exception as e:
             return "Time not available"
+
+    # Function to confirm a city's stored UTC offset against a /weather response (runs in a worker thread)
+    def _refresh_timezone(self, city):
+        try:
+            status, current_weather_data = self.fetch("weather", city)
+            if status == 200:
+                self._capture_timezone(self.normalize_city(city), current_weather_data)
+        except Exception:
+            pass  # Keep the stored offset until the next attempt
     # -------------------------------------------------------------------------------------
     # Get weather function (information of 5-days forecast from OpenWeatherMap API)
     def get_5_day_weather(self, city):
         try:
-            forecast_url = f"https://api.openweathermap.org/data/2.5/forecast?q={city}&appid={self.api_key}"
-            forecast_res = requests.get(forecast_url)
+            status, forecast_table = self.get_forecast(city)
 
-            if forecast_res.status_code == 404:
-                tk.messagebox.showerror("Error", "City not found, please enter again.")
+            if status == 404:
+                self.show_error("Error", "City not found, please enter again.")
+                return None
+            if status != 200:
+                self.show_error("Error", f"Failed to retrieve weather information: {forecast_table.get('message', 'Unknown error')}")
                 return None
 
-            forecast_data = forecast_res.json()
-            daily_forecast = forecast_data.get('list', [])[::8]
-
-            dates = []
-            months = []
-            icons = []
-            temperature_fivedays = []
-            weather_behaviors = []
-
-            for forecast in daily_forecast:
-                date = datetime.fromtimestamp(forecast['dt']).strftime("%d")
-                month = datetime.fromtimestamp(forecast['dt']).strftime("%b")
-                icon_id = forecast['weather'][0]['icon']
-                temperature = forecast['main']['temp'] - 273.15
-                weather_behavior = forecast['weather'][0]['description']
-
-                dates.append(date)
-                months.append(month)
-                icons.append(icon_id)
-                temperature_fivedays.append(temperature)
-                weather_behaviors.append(weather_behavior)
-
-            return dates, months, icons, temperature_fivedays, weather_behaviors
+            # Aggregate the 3-hour slots per local day of the city, keeping the first five days
+            daily = forecast_table.daily()
+            day_dates = [datetime.utcfromtimestamp(int(day) * 86400) for day in daily["day"][:5]]
+
+            dates = [day_date.strftime("%d") for day_date in day_dates]
+            months = [day_date.strftime("%b") for day_date in day_dates]
+            icons = list(daily["icons"][:5])
+            temperature_fivedays = daily["temperature"][:5]
+            weather_behaviors = list(daily["descriptions"][:5])
+            temperature_min = daily["temp_min"][:5]
+            temperature_max = daily["temp_max"][:5]
+
+            return dates, months, icons, temperature_fivedays, weather_behaviors, temperature_min, temperature_max
         except requests.exceptions.RequestException as e:
-            messagebox.showerror("Error", f"Request error: {e}")
+            self.show_error("Error", f"Request error: {e}")
             return None
         except KeyError as e:
-            messagebox.showerror("Error", f"Key error: {e}")
+            self.show_error("Error", f"Key error: {e}")
             return None
     # -------------------------------------------------------------------------------------
     # Get function convert wind into directions
@@ -153,12 +1319,924 @@ class WeatherAPI:
         except ValueError:
             return "Error: Unable to retrieve wind direction!"
 # -------------------------------------------------------------------------------------
+# Create a class to fetch many cities at once (headless, results streamed as they complete)
+# Cities with a known OpenWeatherMap id are fetched 20 at a time through /group, the rest one by one
+class BulkFetcher:
+    GROUP_SIZE = 20  # Maximum ids per /group request
+
+    def __init__(self, api, max_workers=8, ids_path=os.path.join(CACHE_DIR, "city_ids.json")):
+        self.api = api
+        self.max_workers = max_workers
+        self.ids_path = ids_path
+
+    # Function to fetch current conditions (and optionally forecasts), yields one record per city and kind
+    def fetch(self, cities, forecast=False):
+        self._load_ids()
+        # Drop duplicates such as the two 'Hyderabad' entries, keeping the first spelling
+        unique = {}
+        for city in cities:
+            unique.setdefault(self.api.normalize_city(city), city)
+        cities = list(unique.values())
+        known = [city for city in cities if self.api.city_id(city) is not None]
+        unknown = [city for city in cities if self.api.city_id(city) is None]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="weatherwise-bulk") as pool:
+            futures = [pool.submit(self._fetch_group, known[i:i + self.GROUP_SIZE])
+                       for i in range(0, len(known), self.GROUP_SIZE)]
+            futures += [pool.submit(self._fetch_current, city) for city in unknown]
+            if forecast:
+                futures += [pool.submit(self._fetch_forecast, city) for city in cities]
+            try:
+                for future in as_completed(futures):
+                    yield from future.result()
+            finally:
+                self._save_ids()
+
+    # Function to fetch one batch through /group, falling back to single requests if the group call fails
+    def _fetch_group(self, batch):
+        ids = {}  # City id -> every name in the batch that maps to it
+        for city in batch:
+            ids.setdefault(self.api.city_id(city), []).append(city)
+        try:
+            status, data = self.api.fetch_group(list(ids))
+        except Exception:
+            status, data = None, None
+        if status != 200:
+            return [record for city in batch for record in self._fetch_current(city)]
+
+        records = []
+        for current_weather in data.get("list", []):
+            for city in ids.pop(current_weather.get("id"), []):
+                # Group items carry no timezone, only complete payloads go into the response cache
+                if "timezone" in current_weather:
+                    self.api.cache.set(self.api.cache_key("weather", city), current_weather)
+                if self.api.history is not None:
+                    self.api.history.record("weather", self.api.normalize_city(city), current_weather)
+                records.append(self.current_record(city, current_weather))
+        # Cities the group response left out are fetched one by one, so every city gets a record
+        for cities in ids.values():
+            for city in cities:
+                records.extend(self._fetch_current(city))
+        return records
+
+    # Function to fetch one city's current conditions
+    def _fetch_current(self, city):
+        try:
+            status, current_weather = self.api.fetch("weather", city)
+            if status != 200:
+                return [{"city": city, "kind": "current", "error": current_weather.get("message", f"HTTP {status}")}]
+            return [self.current_record(city, current_weather)]
+        except Exception as e:
+            return [{"city": city, "kind": "current", "error": str(e)}]
+
+    # Function to fetch one city's 5-day / 3-hour forecast
+    def _fetch_forecast(self, city):
+        try:
+            status, forecast_table = self.api.get_forecast(city)
+            if status != 200:
+                return [{"city": city, "kind": "forecast", "error": forecast_table.get("message", f"HTTP {status}")}]
+            return [{"city": city, "kind": "forecast", "dt": forecast_table.timestamps.tolist(),
+                     "temperature": np.round(forecast_table.temperature, 2).tolist(),
+                     "description": forecast_table.descriptions.tolist()}]
+        except Exception as e:
+            return [{"city": city, "kind": "forecast", "error": str(e)}]
+
+    # Function to turn a /weather (or /group item) payload into a flat record, temperatures in °C
+    @staticmethod
+    def current_record(city, current_weather):
+        return {
+            "city": city,
+            "kind": "current",
+            "id": current_weather.get("id"),
+            "name": current_weather.get("name"),
+            "country": current_weather.get("sys", {}).get("country"),
+            "dt": current_weather.get("dt"),
+            "temperature": round(current_weather["main"]["temp"], 2),
+            "feels_like": round(current_weather["main"]["feels_like"], 2),
+            "humidity": current_weather["main"]["humidity"],
+            "pressure": current_weather["main"]["pressure"],
+            "wind_speed": current_weather.get("wind", {}).get("speed"),
+            "wind_direction": current_weather.get("wind", {}).get("deg"),
+            "description": current_weather["weather"][0]["description"],
+            "icon": current_weather["weather"][0]["icon"],
+            "lat": current_weather["coord"]["lat"],
+            "lon": current_weather["coord"]["lon"],
+        }
+
+    # Function to load city ids saved by earlier runs, so repeat refreshes can use /group
+    def _load_ids(self):
+        try:
+            with open(self.ids_path, encoding="utf-8") as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return
+        for city, city_id in saved.items():
+            self.api.city_ids.setdefault(city, city_id)
+
+    # Function to save the learned city ids for the next run
+    def _save_ids(self):
+        try:
+            os.makedirs(os.path.dirname(self.ids_path), exist_ok=True)
+            with open(self.ids_path, "w", encoding="utf-8") as file:
+                json.dump(self.api.city_ids, file)
+        except OSError:
+            pass
+
+
+# Function to write records as JSON lines, flushing each one so consumers see it at once
+def write_jsonl(records, file):
+    for record in records:
+        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        file.flush()
+# -------------------------------------------------------------------------------------
+# Function to read the saved favourite cities, returns [] when none are saved
+def load_favourites(path=FAVOURITES_PATH):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return [city for city in json.load(file) if isinstance(city, str) and city.strip()]
+    except (OSError, ValueError, TypeError):
+        return []
+
+
+# Function to save the favourite cities
+def save_favourites(cities, path=FAVOURITES_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(list(cities), file, ensure_ascii=False)
+
+
+# Create a class to refresh favourite cities in the background, so their views open from the cache
+# OpenWeatherMap publishes a new observation about every 10 minutes, so each city is checked once per
+# interval after its last observation (plus jitter to spread the calls), and not at all while its data is current
+class RefreshScheduler:
+    def __init__(self, api, cities=(), interval=600, jitter=60, forecast_interval=3 * 3600, quota_per_minute=60,
+                 quota_margin=0.8, retry_delay=150, max_backoff=8, on_refresh=None):
+        self.api = api
+        self.interval = interval  # OpenWeatherMap update cadence in seconds
+        self.jitter = jitter  # Random seconds added to every refresh time
+        self.forecast_interval = forecast_interval  # The 5-day forecast changes every 3 hours
+        self.quota_per_minute = quota_per_minute  # API calls per minute allowed by the plan
+        self.quota_margin = quota_margin  # Share of the quota the app may use before the scheduler backs off
+        self.retry_delay = retry_delay  # Seconds before checking again when no new observation was published yet
+        self.max_backoff = max_backoff
+        self.on_refresh = on_refresh  # Called from the scheduler thread with the city name when its data changed
+        self.backoff = 1  # Doubles while the quota is nearly used, halves again once it is not
+        self._cities = {}  # normalized city -> city name as given
+        self._next = {}  # normalized city -> time of its next refresh
+        self._due = []  # heap of (time, normalized city), entries not matching _next are outdated
+        self._forecast_at = {}  # normalized city -> time its forecast was last fetched
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        self.set_cities(cities)
+
+    # Function to change the favourite cities, new ones are fetched within the jitter time
+    def set_cities(self, cities):
+        with self._condition:
+            names = {self.api.normalize_city(city): city for city in cities if city.strip()}
+            for key in names.keys() - self._cities.keys():
+                self._schedule(key, time.time() + random.uniform(0, self.jitter))
+            for key in self._cities.keys() - names.keys():
+                self._next.pop(key, None)
+            self._cities = names
+            self._condition.notify()
+
+    # Function to get the favourite city names
+    def cities(self):
+        with self._condition:
+            return list(self._cities.values())
+
+    def _schedule(self, key, due):
+        self._next[key] = due
+        heapq.heappush(self._due, (due, key))
+
+    # Function to start refreshing in a background thread
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="weatherwise-refresh", daemon=True)
+            self._thread.start()
+
+    # Function to stop the background thread (a refresh in progress is finished first)
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._due or self._due[0][0] > time.time()):
+                    self._condition.wait(self._due[0][0] - time.time() if self._due else None)
+                if self._stopped:
+                    return
+                due, key = heapq.heappop(self._due)
+                if self._next.get(key) != due:
+                    continue  # The city was removed or rescheduled
+                city = self._cities[key]
+            try:
+                due = self.refresh(city)
+            except Exception:
+                due = time.time() + self.interval  # Network error, keep the cached data and try next cycle
+            with self._condition:
+                if key in self._cities:
+                    self._schedule(key, due)
+
+    # Function to refresh one city if newer data can exist, returns the time of its next refresh
+    def refresh(self, city):
+        now = time.time()
+        jitter = random.uniform(0, self.jitter)
+        if self.api.calls.count() >= self.quota_per_minute * self.quota_margin:
+            # Leave the rest of the quota to the views, and wait longer while it stays nearly used
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            return now + self.retry_delay * self.backoff + jitter
+        self.backoff = max(1, self.backoff // 2)
+
+        key = self.api.normalize_city(city)
+        cached = self.api.cached("weather", city)
+        last_dt = cached.get("dt") if cached else None
+        if last_dt is not None and now < last_dt + self.interval:
+            return last_dt + self.interval + jitter  # No newer observation is published before then
+        status, data = self.api.fetch("weather", city, force=True)
+        if status != 200:
+            return now + self.interval * self.backoff + jitter
+        changed = data.get("dt") != last_dt
+        if now - self._forecast_at.get(key, 0) >= self.forecast_interval:
+            forecast_status, _ = self.api.fetch("forecast", city, force=True)
+            if forecast_status == 200:
+                self._forecast_at[key] = now
+                changed = True
+        if changed and self.on_refresh is not None:
+            self.on_refresh(city)
+        return now + (self.interval if changed else self.retry_delay) + jitter
+# -------------------------------------------------------------------------------------
+# Create a class for the headless JSON service (asyncio event loop, stdlib HTTP/1.1 with keep-alive)
+# Every client shares one WeatherAPI cache and connection pool, and identical requests in flight share
+# one upstream fetch (singleflight), so OpenWeatherMap traffic grows with distinct cities, not with clients
+class WeatherServer:
+    KNOWN_STATUSES = frozenset(status.value for status in HTTPStatus)
+
+    def __init__(self, api, host="127.0.0.1", port=8080, hourly_slots=8):
+        self.api = api
+        self.host = host
+        self.port = port
+        self.hourly_slots = hourly_slots  # Default number of 3-hour slots returned by /hourly
+        self.routes = {"/current": self.current, "/hourly": self.hourly, "/five-day": self.five_day, "/health": self.health}
+        self._inflight = {}  # Cache key -> future of the fetch in progress
+        self.stats = {"requests": 0, "upstream": 0, "coalesced": 0, "stale": 0}
+
+    # Function to get an endpoint for a city without blocking the event loop, returns (status_code, json data)
+    # Cached entries are answered in the loop (stale ones are refreshed in the background),
+    # a fetch already in progress is awaited instead of repeated
+    async def fetch(self, endpoint, city, count=None):
+        key = self.api.resolve_key(self.api.cache_key(endpoint, city, count))
+        count = key[2]
+        # Hits are counted here, misses are counted once by api.fetch
+        cached = self.api.lookup(key, counted=False)
+        if cached is not None:
+            self.api.cache.count_lookup(cached)
+            if not cached[1]:
+                self.stats["stale"] += 1
+                if self.api._revalidate(endpoint, city, key):
+                    self.stats["upstream"] += 1  # The background refresh goes to OpenWeatherMap
+            return 200, cached[0]
+        future = self._inflight.get(key)
+        if future is None:
+            self.stats["upstream"] += 1  # A cache miss, so this fetch goes to OpenWeatherMap
+            future = asyncio.get_running_loop().run_in_executor(self.api.executor, self.api.fetch, endpoint, city, False, count)
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # A client hanging up must not cancel the fetch the other clients are waiting on
+        return await asyncio.shield(future)
+
+    # Function to answer /current?city=..., current conditions in °C
+    async def current(self, city, query):
+        status, data = await self.fetch("weather", city)
+        if status != 200:
+            return status, data
+        return 200, BulkFetcher.current_record(city, data)
+
+    # Function to answer /hourly?city=...&slots=..., the next 3-hour slots in °C
+    # Every slots value is cut from the one complete forecast that /five-day shares, not fetched on its own
+    async def hourly(self, city, query):
+        slots = int(query.get("slots", [self.hourly_slots])[0])
+        if not 1 <= slots <= 40:
+            raise ValueError("slots must be between 1 and 40")
+        status, data = await self.fetch("forecast", city)
+        if status != 200:
+            return status, data
+        table = self.api.forecast_table(city, data).head(slots)
+        return 200, {"city": city, "dt": table.timestamps.tolist(), "temperature": np.round(table.temperature, 2).tolist(),
+                     "feels_like": np.round(table.feels_like, 2).tolist(), "humidity": table.humidity.tolist(),
+                     "description": table.descriptions.tolist(), "icon": table.icons.tolist()}
+
+    # Function to answer /five-day?city=..., one entry per local day in °C
+    async def five_day(self, city, query):
+        status, data = await self.fetch("forecast", city)
+        if status != 200:
+            return status, data
+        daily = self.api.forecast_table(city, data).daily()
+        return 200, {"city": city,
+                     "date": [datetime.utcfromtimestamp(int(day) * 86400).strftime("%Y-%m-%d") for day in daily["day"][:5]],
+                     "temperature": np.round(daily["temperature"][:5], 2).tolist(),
+                     "temp_min": np.round(daily["temp_min"][:5], 2).tolist(),
+                     "temp_max": np.round(daily["temp_max"][:5], 2).tolist(),
+                     "description": list(daily["descriptions"][:5]), "icon": list(daily["icons"][:5])}
+
+    # Function to answer /health, request counters of the service (and the metrics snapshot when --metrics is on)
+    async def health(self, city, query):
+        body = dict(self.stats, status="ok", cached=len(self.api.cache), calls_last_minute=self.api.calls.count())
+        if METRICS.enabled:
+            body["metrics"] = METRICS.snapshot()
+        return 200, body
+
+    # Function to route one request, returns (status_code, json body)
+    async def route(self, method, target):
+        self.stats["requests"] += 1
+        if method != "GET":
+            return 405, {"message": "Only GET is supported"}
+        url = urlsplit(target)
+        handler = self.routes.get(url.path.rstrip("/") or "/")
+        if handler is None:
+            return 404, {"message": f"Unknown path, use one of {', '.join(self.routes)}"}
+        query = parse_qs(url.query)
+        city = query.get("city", [""])[0].strip()
+        if not city and handler != self.health:
+            return 400, {"message": "Missing ?city= parameter"}
+        try:
+            status, body = await handler(city, query)
+        except ValueError as e:
+            return 400, {"message": str(e)}
+        except Exception as e:
+            return 502, {"message": f"Upstream error: {e}"}
+        if status not in self.KNOWN_STATUSES:
+            # Non-standard upstream codes (e.g. a CDN's 520) have no reason phrase to send
+            return 502, {"message": f"Upstream answered HTTP {status}", "upstream": body}
+        return status, body
+
+    # Function to serve one client connection, answering requests until it closes
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    status, body, version = 400, {"message": "Malformed request line"}, "HTTP/1.0"
+                else:
+                    status, body = await self.route(method, target)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                writer.write(f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                             f"Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass  # Client went away, or sent a line longer than the stream limit
+        finally:
+            writer.close()
+
+    # Function to listen and serve clients until the process is stopped
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        print(f"Serving on http://{self.host}:{server.sockets[0].getsockname()[1]} (/current, /hourly, /five-day, /health)",
+              file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+# -------------------------------------------------------------------------------------
+# Create a class to cache weather icons on disk and in memory
+# PNGs are stored on disk once, decoded images and Tk PhotoImages are kept in memory by icon id
+class IconCache:
+    def __init__(self, transport, directory=os.path.join(CACHE_DIR, "icons")):
+        self.transport = transport
+        self.directory = directory
+        self._images = {}  # Decoded PIL images, filled from any thread
+        self._photos = {}  # Tk PhotoImages, only touched on the Tk thread
+        self._lock = threading.Lock()
+
+    # Function to get the icon id out of an icon URL (".../wn/10d@2x.png" -> "10d")
+    @staticmethod
+    def icon_id(icon_url):
+        return icon_url.rsplit("/", 1)[-1].split("@", 1)[0]
+
+    # Function to get the decoded image for an icon id from memory, disk or the network (any thread)
+    def load(self, icon_id):
+        with self._lock:
+            image = self._images.get(icon_id)
+        if image is not None:
+            METRICS.count("icons.memory")
+            return image
+
+        path = os.path.join(self.directory, f"{icon_id}.png")
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            METRICS.count("icons.disk")
+        except OSError:
+            with METRICS.stage("http.icon"):
+                data = self.transport.get_bytes(ICON_URL.format(icon_id=icon_id))
+            METRICS.count("icons.download")
+            METRICS.count("requests.icon")
+            METRICS.count("bytes.icon", len(data))  # PNGs are sent without content encoding, so this is the transferred size
+            self._save(path, data)
+
+        with METRICS.stage("decode.icon"):
+            image = Image.open(io.BytesIO(data))
+            image.load()  # Decode now so the Tk thread only wraps it
+        with self._lock:
+            self._images[icon_id] = image
+        return image
+
+    # Function to write an icon to disk atomically
+    def _save(self, path, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            pass  # An unwritable cache folder only costs a download next run
+
+    # Function to get the PhotoImage for an icon id, created once and reused (Tk thread only)
+    def photo(self, icon_id):
+        photo = self._photos.get(icon_id)
+        if photo is None:
+            photo = ImageTk.PhotoImage(self.load(icon_id))
+            self._photos[icon_id] = photo
+        return photo
+
+    # Function to load every icon ahead of time so later views need no network (any thread)
+    def prewarm(self, icon_ids=ICON_IDS):
+        for icon_id in icon_ids:
+            try:
+                self.load(icon_id)
+            except Exception:
+                pass  # Missing icons are fetched again on first use
+# -------------------------------------------------------------------------------------
+# Compass sector (from WeatherAPI.get_wind_direction) -> arrow angle in degrees clockwise from north
+COMPASS_ANGLES = {"N": 0, "NE": 45, "E": 90, "SE": 135, "S": 180, "SW": 225, "W": 270, "NW": 315}
+
+
+# Function to get an inline SVG arrow pointing `angle` degrees clockwise from north
+def arrow_svg(angle, size=50, color="#e8731a"):
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="-10 -10 20 20">'
+            f'<path transform="rotate({angle:.0f})" d="M0,-9 L5,-2 L1.5,-2 L1.5,9 L-1.5,9 L-1.5,-2 L-5,-2 Z" '
+            f'fill="{color}" stroke="white" stroke-width="0.6"/></svg>')
+
+
+# Create a class to keep generated wind maps on disk, one per city and compass sector
+# Least recently opened maps are deleted once there are more than max_files
+class WindMapCache:
+    def __init__(self, directory=os.path.join(CACHE_DIR, "maps"), max_files=50):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    # Function to get the file path for a city and sector ("New York", "NE" -> .../new-york_NE.html)
+    def path(self, city, bucket):
+        slug = re.sub(r"[^a-z0-9]+", "-", fold_name(city)).strip("-") or "city"
+        return os.path.join(self.directory, f"{slug}_{bucket}.html")
+
+    # Function to get a saved map, or None if it has not been generated (or was evicted)
+    def get(self, city, bucket):
+        path = self.path(city, bucket)
+        try:
+            os.utime(path)  # Mark as recently used for eviction
+        except OSError:
+            return None
+        return path
+
+    # Function to save a folium map for a city and sector, returns its path
+    def put(self, city, bucket, weather_map):
+        path = self.path(city, bucket)
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        weather_map.save(temp_path)
+        os.replace(temp_path, path)
+        self._evict()
+        return path
+
+    # Function to delete the least recently used maps over the limit
+    def _evict(self):
+        with self._lock:
+            try:
+                paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".html")]
+                paths.sort(key=os.path.getmtime)
+                for path in paths[:-self.max_files]:
+                    os.remove(path)
+            except OSError:
+                pass  # Another process may have removed a file first
+# -------------------------------------------------------------------------------------
+# Function to compute wind arrows for many points in one vectorized pass
+# Returns an array of shape (n, 5, 2) holding [lon, lat] for: tail, tip, left barb end, tip, right barb end
+# Arrows are centred on their point, point along the wind degree (like the single-city map) and grow with speed
+def wind_arrows(lats, lons, speeds, degrees, scale=0.08, min_length=0.15, max_length=1.5, head=0.35, head_angle=25):
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    angle = np.radians(np.asarray(degrees, dtype=float))
+    length = np.clip(np.asarray(speeds, dtype=float) * scale, min_length, max_length)  # In degrees of latitude
+    lon_stretch = 1 / np.maximum(np.cos(np.radians(lats)), 0.1)  # Keep arrows the same size on screen away from the equator
+
+    # Offsets along the arrow, in [d_lon, d_lat]
+    half = 0.5 * length
+    shaft = np.stack([np.sin(angle) * half * lon_stretch, np.cos(angle) * half], axis=-1)
+    barbs = []
+    for side in (-1, 1):
+        barb_angle = angle + np.pi + side * np.radians(head_angle)
+        barbs.append(np.stack([np.sin(barb_angle) * head * length * lon_stretch, np.cos(barb_angle) * head * length], axis=-1))
+
+    centre = np.stack([lons, lats], axis=-1)
+    tip = centre + shaft
+    return np.stack([centre - shaft, tip, tip + barbs[0], tip, tip + barbs[1]], axis=1)
+
+
+# Function to turn BulkFetcher "current" records into one GeoJSON FeatureCollection of wind arrows
+def wind_field_geojson(records, precision=3):
+    records = [record for record in records if record.get("kind") == "current" and record.get("wind_speed") is not None
+               and record.get("wind_direction") is not None]
+    if not records:
+        return {"type": "FeatureCollection", "features": []}
+    columns = np.array([(record["lat"], record["lon"], record["wind_speed"], record["wind_direction"]) for record in records], dtype=float)
+    arrows = np.round(wind_arrows(*columns.T), precision).tolist()
+    return {"type": "FeatureCollection", "features": [
+        {"type": "Feature",
+         "geometry": {"type": "MultiLineString", "coordinates": [arrow[:2], arrow[2:]]},
+         "properties": {"name": record["name"] or record["city"], "speed": round(record["wind_speed"], 1),
+                        "deg": round(record["wind_direction"])}}
+        for record, arrow in zip(records, arrows)]}
+
+
+# Function to save a map with the wind arrows of many cities as a single GeoJSON layer, returns the path
+def build_wind_field_map(records, path):
+    geojson = wind_field_geojson(records)
+    weather_map = folium.Map(location=[20, 0], zoom_start=2, prefer_canvas=True)  # Canvas renders hundreds of lines quickly
+    if geojson["features"]:  # An empty region leaves a blank world map (folium rejects a tooltip without features)
+        folium.GeoJson(geojson, name="Wind", style_function=lambda feature: {"color": "#e8731a", "weight": 2},
+                       tooltip=folium.GeoJsonTooltip(fields=["name", "speed", "deg"], aliases=["City", "Wind (m/s)", "Direction (°)"])
+                       ).add_to(weather_map)
+        points = np.array([point for feature in geojson["features"] for line in feature["geometry"]["coordinates"] for point in line])
+        weather_map.fit_bounds([[points[:, 1].min(), points[:, 0].min()], [points[:, 1].max(), points[:, 0].max()]])
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    weather_map.save(path)
+    return path
+
+
+# Function to build and save the wind direction map of a city, returns its filename or None if the city has no weather
+def save_wind_map(api, wind_maps, city):
+    result = api.get_weather(city)
+
+    if result is not None:
+        lat, lon = result.lat, result.lon
+        bucket = api.get_wind_direction(result.wind_direction)
+
+        # Reuse the saved map while the wind stays in the same compass sector
+        map_filename = wind_maps.get(city, bucket)
+        if map_filename is not None:
+            return map_filename
+
+        with METRICS.stage("render.map"):
+            # Create a folium map centered around the city
+            weather_map = folium.Map(location=[lat, lon], zoom_start=11)
+
+            # Add a marker for the city
+            folium.Marker([lat, lon], popup=f"{city}, Wind Direction: {bucket}").add_to(weather_map)
+
+            # Add five arrow markers in a straight line, drawn as inline SVG so no image is downloaded
+            for i in range(5):
+                arrow_icon = folium.DivIcon(html=arrow_svg(COMPASS_ANGLES[bucket]), icon_size=(50, 50), icon_anchor=(25, 25))
+                folium.Marker([lat - 0.05 + i * 0.03, lon - 0.05 + i * 0.03], popup="Wind Direction", icon=arrow_icon).add_to(weather_map)
+
+            map_filename = wind_maps.put(city, bucket, weather_map)
+        return map_filename
+    return None
+
+
+# Function to parse a "south,west,north,east" bounding box for --region, raises argparse.ArgumentTypeError
+def parse_region(text):
+    try:
+        region = tuple(float(value) for value in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid box {text!r}, expected four numbers S,W,N,E")
+    if len(region) != 4:
+        raise argparse.ArgumentTypeError(f"invalid box {text!r}, expected four numbers S,W,N,E")
+    south, west, north, east = region
+    if not -90 <= south <= north <= 90:
+        raise argparse.ArgumentTypeError(f"invalid box {text!r}, latitudes must satisfy -90 <= S <= N <= 90")
+    if not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise argparse.ArgumentTypeError(f"invalid box {text!r}, longitudes must be between -180 and 180")
+    return region
+
+
+# Function to keep records inside a bounding box (south, west, north, east)
+# A box with west > east crosses the 180th meridian
+def in_region(records, region):
+    south, west, north, east = region
+    return [record for record in records
+            if "lat" in record and south <= record["lat"] <= north
+            and ((west <= record["lon"] <= east) if west <= east else (record["lon"] >= west or record["lon"] <= east))]
+# -------------------------------------------------------------------------------------
+# Create a class to run slow work (HTTP, image decoding) off the Tk mainloop
+# Results are queued by the worker threads and delivered on the Tk thread by an after() poll
+class BackgroundWorker:
+    def __init__(self, root, max_workers=4, poll_ms=30):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="weatherwise-ui")
+        self.on_busy_change = None  # Called with True/False when work starts/stops (loading indicator)
+        self._queue = queue.Queue()
+        self._generations = {}  # Latest job number per channel, older jobs on a channel are superseded
+        self._futures = {}
+        self._pending = 0
+        self.root.after(self.poll_ms, self._poll)
+
+    # Function to run func(*args) in the background and call on_done(result) on the Tk thread
+    # Submitting again on the same channel cancels the previous job and drops its result
+    def submit(self, channel, func, on_done, *args, on_error=None):
+        generation = self._generations.get(channel, 0) + 1
+        self._generations[channel] = generation
+        previous = self._futures.get(channel)
+        if previous is not None:
+            previous.cancel()  # Only stops jobs that have not started, running ones are ignored when they finish
+
+        started = None
+        if METRICS.enabled:
+            started = time.perf_counter()
+            func = METRICS.timed(f"work.{channel}", func)
+        future = self.executor.submit(func, *args)
+        self._futures[channel] = future
+        self._set_pending(self._pending + 1)
+        future.add_done_callback(lambda done: self._queue.put(("job", channel, generation, done, on_done, on_error, started)))
+        return future
+
+    # Function to check whether a job is still the latest one on its channel
+    def is_current(self, channel, generation):
+        return self._generations.get(channel) == generation
+
+    # Function to check whether a job on a channel has not been delivered yet
+    def is_pending(self, channel):
+        return channel in self._futures
+
+    # Function to call func(*args) on the Tk thread, safe to use from any thread
+    def post(self, func, *args):
+        self._queue.put(("call", func, args))
+
+    # Function to drain the queue on the Tk thread, then schedule the next poll
+    # A failing item is reported and skipped, the rest of the queue and later polls still run
+    def _poll(self):
+        try:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if item[0] == "call":
+                        item[1](*item[2])
+                    else:
+                        self._finish(*item[1:])
+                except Exception as e:
+                    messagebox.showerror("Error", f"An error occurred: {e}")
+        finally:
+            self.root.after(self.poll_ms, self._poll)
+
+    # Function to deliver a finished job unless it was cancelled or superseded
+    # With instrumentation on, times the Tk update (ui.<channel>) and the whole action from the click (action.<channel>)
+    def _finish(self, channel, generation, future, on_done, on_error, started):
+        self._set_pending(self._pending - 1)
+        if self._futures.get(channel) is future:
+            del self._futures[channel]
+        if future.cancelled() or not self.is_current(channel, generation):
+            return
+        error = future.exception()
+        try:
+            if error is None:
+                with METRICS.stage(f"ui.{channel}"):
+                    on_done(future.result())
+            elif on_error is not None:
+                on_error(error)
+            else:
+                messagebox.showerror("Error", f"An error occurred: {error}")
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred: {e}")
+        if started is not None:
+            METRICS.record(f"action.{channel}", time.perf_counter() - started)
+
+    # Function to track the number of jobs in flight and notify the loading indicator
+    def _set_pending(self, pending):
+        was_busy = self._pending > 0
+        self._pending = pending
+        if self.on_busy_change is not None and was_busy != (pending > 0):
+            self.on_busy_change(pending > 0)
+
+    # Function to stop accepting work, cancelling jobs that have not started
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+# -------------------------------------------------------------------------------------
+# Create a class for the hourly forecast chart, one window and figure reused for every hourly view
+# Only the line data changes between views with the same axes, so those redraws blit the line onto a cached background
+class HourlyChart:
+    def __init__(self, root):
+        self.window = tk.Toplevel(root)
+        self.window.title("Hourly Forecast")
+        self.figure = mpl_figure.Figure(figsize=(10, 6))
+        self.axes = self.figure.add_subplot()
+        self.axes.grid(True)
+        # Animated, so full draws leave it out of the cached background
+        self.line, = self.axes.plot([], [], marker='o', linestyle='-', color='orange', animated=True)
+        self.canvas = mpl_tkagg.FigureCanvasTkAgg(self.figure, master=self.window)
+        self.canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self._background = None
+        self._layout = None  # Title, labels, ticks and limits currently drawn in the background
+
+    # Function to check whether the chart window is still open
+    def is_open(self):
+        return self.window is not None and self.window.winfo_exists()
+
+    # Function to show new data, redrawing the axes only when the title, ticks or limits change
+    def update(self, timestamps, temperatures, tick_labels, title, ylabel):
+        self.line.set_data(timestamps, temperatures)
+        # Round the y limits out to 5 degrees so small changes keep the same background
+        ylim = (5 * (min(temperatures) // 5) - 5, 5 * (max(temperatures) // 5) + 5) if len(temperatures) else (0, 1)
+        layout = (title, ylabel, tuple(timestamps), tuple(tick_labels), ylim)
+
+        if layout == self._layout and self._background is not None:
+            self.canvas.restore_region(self._background)
+            self.axes.draw_artist(self.line)
+            self.canvas.blit(self.figure.bbox)
+            return
+
+        self.axes.set_title(title)
+        self.axes.set_xlabel('Time 24 hours from now (AM/PM)')
+        self.axes.set_ylabel(ylabel)
+        # Set the x-axis labels to AM/PM format
+        self.axes.set_xticks(timestamps, tick_labels, rotation=45)
+        if len(timestamps):
+            self.axes.set_xlim(timestamps[0] - 1800, timestamps[-1] + 1800)
+        self.axes.set_ylim(*ylim)
+        if self._layout is None:
+            self.figure.tight_layout()  # Margins fit the AM/PM labels, which keep the same width afterwards
+        self._layout = layout
+        self.canvas.draw()  # Fires draw_event, which caches the background and draws the line
+
+    # Function to cache the freshly drawn background and paint the line over it
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.axes.draw_artist(self.line)
+        self.canvas.blit(self.figure.bbox)
+
+    # Function to close the window and free the figure
+    def close(self):
+        self._background = None
+        self.figure.clear()
+        if self.window is not None:
+            self.window.destroy()
+            self.window = None
+# -------------------------------------------------------------------------------------
+# Function to format a metrics snapshot as a text table for the debug panel
+def format_metrics(snapshot, quota_per_minute):
+    lines = [f"{'Stage':<28}{'count':>7}{'avg ms':>11}{'max ms':>11}{'total ms':>12}"]
+    for name, stage in snapshot["stages"].items():
+        lines.append(f"{name:<28}{stage['count']:>7}{stage['avg_ms']:>11.2f}{stage['max_ms']:>11.2f}{stage['total_ms']:>12.1f}")
+    lines += ["", f"{'Counter':<28}{'value':>12}"]
+    lines += [f"{name:<28}{value:>12}" for name, value in snapshot["counters"].items()]
+
+    def percent(rate):
+        return "-" if rate is None else f"{rate:.0%}"
+
+    lines += ["", f"Response cache hit rate: {percent(snapshot['cache_hit_rate'])}",
+              f"Icon cache hit rate: {percent(snapshot['icon_hit_rate'])}",
+              f"Quota: {snapshot['gauges'].get('quota.calls_last_minute', 0)} of {quota_per_minute} calls in the last minute"]
+    return "\n".join(lines)
+
+
+# Create a class for the debug panel (F12), showing live stage timings, counters, hit rates and quota usage
+# Instrumentation is switched on while the panel is open
+class DebugPanel:
+    def __init__(self, root, quota_per_minute, refresh_ms=1000):
+        self.quota_per_minute = quota_per_minute
+        self.refresh_ms = refresh_ms
+        self._was_enabled = METRICS.enabled  # Keep instrumentation on after closing when --metrics turned it on
+        METRICS.enable()
+        self.window = tk.Toplevel(root)
+        self.window.title("Debug")
+        self.text = tk.Text(self.window, font="Courier 10", width=70, height=32)
+        self.text.pack(fill="both", expand=True)
+        buttons = tk.Frame(self.window)
+        buttons.pack(fill="x")
+        ttk.Button(buttons, text="Reset", command=METRICS.reset, style="TButton").pack(side="left", padx=5, pady=5)
+        ttk.Button(buttons, text="Save JSON", command=self.save, style="TButton").pack(side="left", padx=5, pady=5)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.refresh()
+
+    # Function to check whether the panel window is still open
+    def is_open(self):
+        return self.window is not None and self.window.winfo_exists()
+
+    # Function to redraw the panel, then schedule the next redraw
+    def refresh(self):
+        if not self.is_open():
+            return
+        self.text.configure(state="normal")
+        self.text.delete("1.0", "end")
+        self.text.insert("end", format_metrics(METRICS.snapshot(), self.quota_per_minute))
+        self.text.configure(state="disabled")
+        self.window.after(self.refresh_ms, self.refresh)
+
+    # Function to write the current snapshot to ~/.cache/weatherwise/metrics.json
+    def save(self):
+        path = os.path.join(CACHE_DIR, "metrics.json")
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(METRICS.snapshot(), file, indent=2)
+        messagebox.showinfo("Metrics saved", path, parent=self.window)
+
+    # Function to close the panel, turning instrumentation off again unless it was already on
+    def close(self):
+        if not self._was_enabled:
+            METRICS.disable()
+        if self.window is not None:
+            self.window.destroy()
+            self.window = None
+# -------------------------------------------------------------------------------------
+# Create a class to hold the last fetched weather per city, so views re-render without refetching
+class WeatherViewModel:
+    def __init__(self, normalize_city, max_cities=32):
+        self.normalize_city = normalize_city
+        self.max_cities = max_cities
+        self._states = OrderedDict()  # normalized city -> {"current": ..., "hourly": ..., "five_day": ..., ...}
+        # City shown by each view (None when the view has not been opened)
+        self.main_city = None
+        self.hourly_city = None
+        self.five_day_city = None
+
+    # Function to store fields for a city (e.g. current=result, hourly=result, five_day=results)
+    def update(self, city, **fields):
+        key = self.normalize_city(city)
+        state = self._states.setdefault(key, {})
+        state.update(fields)
+        self._states.move_to_end(key)
+        while len(self._states) > self.max_cities:
+            self._states.popitem(last=False)
+
+    # Function to get a stored field for a city, or None
+    def get(self, city, field):
+        if city is None:
+            return None
+        return self._states.get(self.normalize_city(city), {}).get(field)
+# -------------------------------------------------------------------------------------
 # Create a class for WeatherWise app tkinter
 class WeatherApp(tk.Tk):
-    def __init__(self, api_key):
+    # data_dir holds the timezones, icons, maps and history kept between runs (a scratch folder for replayed data)
+    def __init__(self, api_key, prewarm_icons=True, warm_up=True, favourites=None, quota_per_minute=60, transport=None,
+                 data_dir=CACHE_DIR):
         super().__init__()
-        self.api = WeatherAPI(api_key)
+        # Built-in city names are searchable at once, the full OWM catalogue index replaces them once loaded
+        self.city_index = CityIndex.from_names(self.city_list)
+        # Every observation and forecast fetched is kept for past trends
+        self.history = HistoryStore(os.path.join(data_dir, "history.sqlite3"))
+        self.api = WeatherAPI(api_key, city_index=self.city_index, history=self.history, transport=transport,
+                              timezones=TimezoneStore(os.path.join(data_dir, "timezones.json")))
+        # Run network and decoding off the Tk thread, errors from the API are shown on the Tk thread
+        self.worker = BackgroundWorker(self)
+        self.worker.on_busy_change = self.set_loading
+        self.api.show_error = lambda title, message: self.worker.post(messagebox.showerror, title, message)
+        # Weather icons shared by the main view and the 5-day panel
+        self.icons = IconCache(self.api.transport, os.path.join(data_dir, "icons"))
+        self.api.executor.submit(self.load_city_index)
+        # Once the window is up, import charts/maps and load icons in the background
+        self.after(200, self.warm_up, warm_up, prewarm_icons)
+        # Last fetched weather per city, and the open views that show it
+        self.view_model = WeatherViewModel(self.api.normalize_city)
+        self.hourly_chart = None
+        self.forecast_panel = None
+        # Saved wind maps, reused per city and wind direction
+        self.wind_maps = WindMapCache(os.path.join(data_dir, "maps"))
+        # Instrumentation panel, toggled with F12
+        self.quota_per_minute = quota_per_minute
+        self.debug_panel = None
+        self.bind("<F12>", self.toggle_debug_panel)
+        # Favourite cities are kept fresh in the background, the main view follows when its city changes
+        self.scheduler = RefreshScheduler(self.api, load_favourites() if favourites is None else favourites,
+                                          quota_per_minute=quota_per_minute,
+                                          on_refresh=lambda city: self.worker.post(self.refresh_view, city))
+        self.scheduler.start()
         self.title("Weather Wise")
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
         self.geometry("600x600")
         self.grid_rowconfigure(0, weight=1)  # Allow row 0 (city entry) to expand
         self.grid_rowconfigure(1, weight=1)  # Row 1 (buttons) can expand
@@ -178,7 +2256,7 @@ class WeatherApp(tk.Tk):
         # Create a Frame to hold the buttons and center it
         self.frame = tk.Frame(self)
         self.frame.grid(row=1, columnspan=3, pady=0, padx=10, sticky="n")
-        # Set ttkbootstrap style
+        # Set ttk style
         self.style = ttk.Style()
         self.style.theme_use('classic')
         self.create_widgets()
@@ -252,9 +2330,16 @@ class WeatherApp(tk.Tk):
         self.temperature_unit_combobox = ttk.Combobox(self, values=["Celsius (°C)", "Fahrenheit (°F)"], font="Helvetica 12", style="TCombobox")
         self.temperature_unit_combobox.grid(column=1, row=13, padx=10, pady=10, sticky="ne")
         self.temperature_unit_combobox.set("Celsius (°C)")
+        # Re-render the open views from memory when the unit changes
+        self.temperature_unit_combobox.bind("<<ComboboxSelected>>", self.change_unit)
+
+        # Loading indicator, shown while background requests are in flight
+        self.loading_bar = ttk.Progressbar(self, mode="indeterminate", length=120)
+        self.loading_bar.grid(column=0, row=13, padx=10, pady=10, sticky="nw")
+        self.loading_bar.grid_remove()
 
         # Bind the key release event to dynamically filter the city list
-        self.city_combobox.bind("<KeyRelease>", lambda event, city_list=self.city_list: self.set_completion_list(city_list, event))
+        self.city_combobox.bind("<KeyRelease>", self.set_completion_list)
         # Create a Frame to hold the buttons and center it
         self.frame = tk.Frame(self)
         self.frame.grid(row=1, columnspan=3, pady=0, padx=10, sticky="n")
@@ -275,57 +2360,127 @@ class WeatherApp(tk.Tk):
         self.wind_map_button = ttk.Button(self.frame, text="Wind-FD Map", command=lambda: self.create_wind_map(self.city_combobox.get()), style="TButton")
         self.wind_map_button.grid(row=0, column=3, padx=10)
         
+    # Function to write pending history and stop background work before closing the window
+    def on_close(self):
+        self.scheduler.stop()
+        self.worker.shutdown()
+        self.history.close()
+        self.api.timezones.save()  # Check times that changed since the last write
+        self.destroy()
+
+    # Function to start background warm-up of heavy imports and icons (runs on the Tk thread)
+    def warm_up(self, imports, icons):
+        if imports:
+            self.api.executor.submit(warm_up_imports)
+        if icons:
+            self.api.executor.submit(self.icons.prewarm)
+
+    # Function to open or close the debug panel
+    def toggle_debug_panel(self, event=None):
+        if self.debug_panel is not None and self.debug_panel.is_open():
+            self.debug_panel.close()
+            self.debug_panel = None
+        else:
+            self.debug_panel = DebugPanel(self, self.quota_per_minute)
+
+    # Function to show or hide the loading indicator
+    def set_loading(self, busy):
+        if busy:
+            self.loading_bar.grid()
+            self.loading_bar.start(10)
+        else:
+            self.loading_bar.stop()
+            self.loading_bar.grid_remove()
+
     # Function to set the Combobox completion list
-    def set_completion_list(self, entries, event):
-        pattern = event.widget.get().lower()
-        event.widget["values"] = [e for e in entries if pattern in e.lower()]
+    def set_completion_list(self, event):
+        pattern = event.widget.get()
+        event.widget["values"] = self.city_index.complete(pattern) if pattern.strip() else self.city_list
+
+    # Function to load the saved OWM city catalogue index (runs in a worker thread)
+    def load_city_index(self):
+        try:
+            index = CityIndex.load_default()
+        except Exception:
+            return  # Keep using the built-in city names
+        if index is not None:
+            self.worker.post(self.use_city_index, index)
+
+    # Function to switch autocomplete and API lookups to a new city index (runs on the Tk thread)
+    def use_city_index(self, index):
+        self.city_index = index
+        self.api.city_index = index
     # -------------------------------------------------------------------------------------
     # Global variable to store the icon
     icon = None
     # Search function
     def search(self):
+        selected_city = self.cityString.get()  # Get the selected city from the dropdown
+        self.worker.submit("search", self.fetch_search, self.show_search, selected_city)
+
+    # Function to redraw the main view when the scheduler refreshed its city (runs on the Tk thread)
+    # Runs on its own channel and yields to searches, so a refresh never replaces the result of a click
+    def refresh_view(self, city):
+        if self.is_main_city(city) and not self.worker.is_pending("search"):
+            self.worker.submit("refresh", self.fetch_search, self.show_refresh, city)  # Served from the cache
+
+    # Function to show a refreshed main view, unless a search has changed or is changing the city meanwhile
+    def show_refresh(self, fetched):
+        if fetched is not None and self.is_main_city(fetched[0]) and not self.worker.is_pending("search"):
+            self.show_search(fetched)
+
+    # Function to check whether a city is the one shown in the main view
+    def is_main_city(self, city):
+        main_city = self.view_model.main_city
+        return main_city is not None and self.api.normalize_city(main_city) == self.api.normalize_city(city)
+
+    # Function to fetch the weather, local time and decoded icon for a search (runs in a worker thread)
+    def fetch_search(self, selected_city):
+        result = self.api.get_weather(selected_city)
+        if result is None:
+            return None
+        current_time = self.api.get_current_time(selected_city)  # Same cache entry as the query above
+        icon_id = IconCache.icon_id(result.icon_url)
+        self.icons.load(icon_id)  # Download/decode here rather than on the Tk thread
+        return selected_city, result, current_time, icon_id
+
+    # Function to show the search results (runs on the Tk thread)
+    def show_search(self, fetched):
+        if fetched is None:
+            return
+        selected_city, result, current_time, icon_id = fetched
+        self.view_model.update(selected_city, current=result)
+        self.view_model.main_city = selected_city
         try:
-            selected_city = self.cityString.get()  # Get the selected city from the dropdown
-            result = self.api.get_weather(selected_city)
-            if result is None:
-                return
-            # If the city is found, unpack the weather information
-            icon_url, temperature, description, city, country, wind_speed, wind_direction, pressure, humidity, dew_point, visibility,feels_like, timestamps, hourly_temperatures, lat, lon = result
-            self.location_label.configure(text=f"{city}, {country}")
+            # If the city is found, show the weather information
+            self.location_label.configure(text=f"{result.city}, {result.country}")
 
-            # Get the weather icon image and update the icon
-            image = Image.open(requests.get(icon_url, stream=True).raw)
-            self.icon = ImageTk.PhotoImage(image)
+            # Update the icon with the image decoded in the background
+            self.icon = self.icons.photo(icon_id)
             self.icon_label.configure(image=self.icon) 
 
-            # Get the current time
-            current_time = self.api.get_current_time(city)  
+            # Show the current time
             self.current_time_label.configure(text=f"{current_time}")
             
             # Update the temperature and description labels
-            self.temperature_label.configure(text=f"Temperature: {temperature:.2f} ")
-            self.feels_like_label.configure(text=f"Feels like: {feels_like:.2f} ")
-            self.description_label.configure(text=f"Description: {description}")
+            self.temperature_label.configure(text=f"Temperature: {result.temperature:.2f} ")
+            self.feels_like_label.configure(text=f"Feels like: {result.feels_like:.2f} ")
+            self.description_label.configure(text=f"Description: {result.description}")
             
-            self.wind_label.configure(text=f"Wind Speed: {wind_speed} m/s {self.api.get_wind_direction(wind_direction)}")
-            self.pressure_label.configure(text=f"Pressure: {pressure} hPa")
-            self.humidity_label.configure(text=f"Humidity: {humidity}%")
-            self.dew_point_label.configure(text=f"Dew Point: {dew_point:.2f} ")
-            self.visibility_label.configure(text=f"Visibility: {visibility} meters")
+            self.wind_label.configure(text=f"Wind Speed: {result.wind_speed} m/s {self.api.get_wind_direction(result.wind_direction)}")
+            self.pressure_label.configure(text=f"Pressure: {result.pressure} hPa")
+            self.humidity_label.configure(text=f"Humidity: {result.humidity}%")
+            self.dew_point_label.configure(text=f"Dew Point: {result.dew_point:.2f} ")
+            self.visibility_label.configure(text=f"Visibility: {result.visibility} meters")
             
-            self.update_temperature_display()
+            self.update_temperature_display(result)
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {e}")
             
     # Function to update the temperature display based on the selected unit
-    def update_temperature_display(self):
+    def update_temperature_display(self, result):
         selected_unit = self.temperature_unit_combobox.get()
-        result = self.api.get_weather(self.cityString.get())
-
-        if result is None:
-            return
-
-        icon_url, temperature, description, city, country, wind_speed, wind_direction, pressure, humidity, dew_point, visibility, feels_like, timestamps, hourly_temperatures, lat, lon = result
+        temperature, feels_like, dew_point = result.temperature, result.feels_like, result.dew_point
 
         if selected_unit == "Fahrenheit (°F)":
             # Convert temperature from Celsius to Fahrenheit
@@ -336,20 +2491,44 @@ class WeatherApp(tk.Tk):
         self.temperature_label.configure(text=f"Temperature: {temperature:.2f}°{selected_unit}")
         self.feels_like_label.configure(text=f"Feels like: {feels_like:.2f}°{selected_unit}")
         self.dew_point_label.configure(text=f"Dew Point: {dew_point:.2f}°{selected_unit} ")
+
+    # Function to re-render every open view in the selected unit from the stored weather (no HTTP calls)
+    def change_unit(self, event=None):
+        main_result = self.view_model.get(self.view_model.main_city, "current")
+        if main_result is not None:
+            self.update_temperature_display(main_result)
+
+        hourly_result = self.view_model.get(self.view_model.hourly_city, "hourly")
+        if hourly_result is not None and self.hourly_chart is not None and self.hourly_chart.is_open():
+            self.update_temperature_and_forecast_display(self.temperature_unit_combobox, hourly_result)
+
+        five_day = self.view_model.get(self.view_model.five_day_city, "five_day")
+        if five_day is not None and self.forecast_panel is not None and self.forecast_panel.winfo_exists():
+            self.update_temperature_5_days(self.temperature_unit_combobox, self.forecast_panel, five_day)
     # -------------------------------------------------------------------------------------
     # Hourly forecast button
     def hourly_button(self):
         selected_city = self.cityString.get()  # Get the selected city from the dropdown
-        result = self.api.get_weather(selected_city)
+        self.worker.submit("hourly", self.fetch_hourly, self.show_hourly_result, selected_city)
+
+    # Function to fetch the hourly forecast (runs in a worker thread), returns (city, result)
+    def fetch_hourly(self, selected_city):
+        return selected_city, self.api.get_weather(selected_city, True)
+
+    # Function to plot the hourly forecast once it has been fetched (runs on the Tk thread)
+    # The chart's city changes only now, so a failed or superseded fetch leaves the shown city in place
+    def show_hourly_result(self, fetched):
+        city, result = fetched
         if result is not None:
-            icon_url, temperature, description, city, country, wind_speed, wind_direction, pressure, humidity, dew_point, visibility, feels_like, timestamps, hourly_temperatures, lat, lon = result
-            self.update_temperature_and_forecast_display(self.temperature_unit_combobox)  # Pass the combobox as a parameter
+            self.view_model.hourly_city = city
+            self.view_model.update(city, hourly=result)
+            self.update_temperature_and_forecast_display(self.temperature_unit_combobox, result)  # Pass the combobox as a parameter
 
     # Graph for hourly forecast
     def show_hourly_forecast(self, city, country, timestamps, hourly_temperatures, selected_unit):
         try:
-            # Limit the forecast to show only the next 8 hours
-            max_hours_ahead = 8
+            # Limit the forecast to show only the next 8 slots
+            max_hours_ahead = HOURLY_SLOTS
             timestamps = timestamps[:max_hours_ahead]
             hourly_temperatures = hourly_temperatures[:max_hours_ahead]
             
@@ -358,24 +2537,18 @@ class WeatherApp(tk.Tk):
         
         # Convert temperatures to Fahrenheit if selected_unit is "Fahrenheit (°F)"
             if selected_unit == "Fahrenheit (°F)":
-                hourly_temperatures = [(temp * 9/5) + 32 for temp in hourly_temperatures]
+                hourly_temperatures = ForecastTable.to_fahrenheit(hourly_temperatures)
                 y_value = 'Temperature (°F)'  # Update the y-label
             else:
                 y_value = 'Temperature (°C)'  # Default to Celsius
             
-            # Create the plot
-            plt.figure(figsize=(10, 6))
-            plt.plot(timestamps, hourly_temperatures, marker='o', linestyle='-', color='orange')
-            plt.title(f'Hourly Temperature Forecast for {city}, {country}')
-            plt.xlabel(f'Time 24 hours from now (AM/PM)')
-            plt.ylabel(y_value)
-            
-            # Set the x-axis labels to AM/PM format
-            plt.xticks(timestamps, am_pm_labels, rotation=45)
-            
-            plt.grid(True)
-            plt.tight_layout()
-            plt.show()
+            # Reuse the open chart window, otherwise create it
+            if self.hourly_chart is None or not self.hourly_chart.is_open():
+                self.hourly_chart = HourlyChart(self)
+            with METRICS.stage("render.hourly"):
+                self.hourly_chart.update(timestamps, hourly_temperatures, am_pm_labels,
+                                         f'Hourly Temperature Forecast for {city}, {country}', y_value)
+            self.hourly_chart.window.lift()
         except ValueError:
             return "Invalid Time for hourly forecast"
         
@@ -391,119 +2564,371 @@ class WeatherApp(tk.Tk):
             return "Invalid Time"
         
     # Function to update the temperature display and hourly forecast based on the selected unit
-    def update_temperature_and_forecast_display(self, temperature_unit_combobox):
+    def update_temperature_and_forecast_display(self, temperature_unit_combobox, result):
         selected_unit = temperature_unit_combobox.get()
-        result = self.api.get_weather(self.city_combobox.get())
-
-        if result is None:
-            return
-
-        icon_url, temperature, description, city, country, wind_speed, wind_direction, pressure, humidity, dew_point, visibility, feels_like, timestamps, hourly_temperatures, lat, lon = result
-
-        if selected_unit == "Fahrenheit (°F)":
-            # Convert temperature from Celsius to Fahrenheit
-            temperature = (temperature * 9/5) + 32
-            feels_like = (feels_like * 9/5) + 32
 
         # Update the hourly forecast display with the selected temperature unit
-        self.show_hourly_forecast(city, country, timestamps, hourly_temperatures, selected_unit)
+        self.show_hourly_forecast(result.city, result.country, result.timestamps, result.hourly_temperatures, selected_unit)
     # -------------------------------------------------------------------------------------
     # Function to display five days forecast
     def display_5_day_forecast(self):
         selected_city = self.cityString.get()
+        self.worker.submit("5-day", self.fetch_5_day_forecast, self.show_5_day_forecast, selected_city)
+
+    # Function to fetch the 5-day forecast and decode its icons (runs in a worker thread), returns (city, results)
+    def fetch_5_day_forecast(self, selected_city):
         results = self.api.get_5_day_weather(selected_city)
         if not results:
+            return selected_city, None
+        # Icons come from the icon cache, so repeated codes are decoded once
+        for icon_id in results[2][:5]:
+            self.icons.load(icon_id)
+        return selected_city, results
+
+    # Function to show the 5-day forecast panel (runs on the Tk thread)
+    def show_5_day_forecast(self, fetched):
+        city, fetched = fetched
+        if not fetched:
             return
 
-        dates, months, icons, temperature_fivedays, weather_behaviors = results
+        dates, months, icons, temperature_fivedays, weather_behaviors, temperature_min, temperature_max = fetched
 
         if not dates:
             return
-
-        forecast_panel = tk.Toplevel(self)
-        forecast_panel.title("5-Day Forecast")
-        forecast_panel.geometry("500x600")
-
-        for i in range(5):
+        self.view_model.five_day_city = city
+        self.view_model.update(city, five_day=fetched)
+
+        # Reuse the open panel, otherwise create it
+        if self.forecast_panel is not None and self.forecast_panel.winfo_exists():
+            forecast_panel = self.forecast_panel
+            for child in list(forecast_panel.children.values()):
+                child.destroy()
+        else:
+            forecast_panel = tk.Toplevel(self)
+            forecast_panel.title("5-Day Forecast")
+            forecast_panel.geometry("500x600")
+            self.forecast_panel = forecast_panel
+
+        for i in range(len(dates)):
             day_label = tk.Label(forecast_panel, text=f"{dates[i]} {months[i]}", font="Helvetica 12")
             day_label.grid(row=i, column=0, padx=10, pady=5)
 
-            icon_url = f"https://openweathermap.org/img/wn/{icons[i]}@2x.png"
-            image = Image.open(requests.get(icon_url, stream=True).raw)
-            icon_image = ImageTk.PhotoImage(image)
+            icon_image = self.icons.photo(icons[i])
             icon_label = tk.Label(forecast_panel, image=icon_image)
             icon_label.image = icon_image
             icon_label.grid(row=i, column=1, padx=10, pady=5)
 
-            temperature_unit = self.temperature_unit_combobox.get()
-            temperature_value = temperature_fivedays[i] if temperature_unit == 'Celsius (°C)' else (temperature_fivedays[i] * 9/5) + 32
-            temperature_unit_label = "°C" if temperature_unit == 'Celsius (°C)' else "°F"
-
-            temperature_label = tk.Label(forecast_panel, text=f"Temp: {temperature_value:.2f}{temperature_unit_label}", font="Helvetica 12")
+            # Text is filled in by update_temperature_5_days for the selected unit
+            temperature_label = tk.Label(forecast_panel, name=f"temperature_label_{i}", font="Helvetica 12")
             temperature_label.grid(row=i, column=2, padx=10, pady=5)
 
             weather_label = tk.Label(forecast_panel, text=f"Description: {weather_behaviors[i]}", font="Helvetica 12")
             weather_label.grid(row=i, column=3, padx=10, pady=5)
-    # Function to handle the 5-Day Forecast button click
+
+        self.update_temperature_5_days(self.temperature_unit_combobox, forecast_panel, fetched)
+    # Function to handle the 5-Day Forecast button click (the panel opens in the selected unit)
     def display_5_days_button(self):
         self.display_5_day_forecast()
-        self.update_temperature_5_days()
     
     # Function to update the 5-day forecast display based on the selected unit
-    def update_temperature_5_days(self, temperature_unit_combobox, forecast_panel, temperature_fivedays):
+    def update_temperature_5_days(self, temperature_unit_combobox, forecast_panel, five_day):
         selected_unit = temperature_unit_combobox.get()
+        dates, months, icons, temperature_fivedays, weather_behaviors, temperature_min, temperature_max = five_day
 
-        for i in range(5):
-            temperature_value = temperature_fivedays[i] if selected_unit == 'Celsius (°C)' else (temperature_fivedays[i] * 9/5) + 32
-            temperature_unit_label = "°C" if selected_unit == 'Celsius (°C)' else "°F"
+        # Convert every day at once if Fahrenheit is selected
+        if selected_unit != 'Celsius (°C)':
+            temperature_fivedays, temperature_min, temperature_max = (ForecastTable.to_fahrenheit(values) for values in
+                                                                      (temperature_fivedays, temperature_min, temperature_max))
+        temperature_unit_label = "°C" if selected_unit == 'Celsius (°C)' else "°F"
 
+        for i in range(len(dates)):
+            # Daily mean, with the day's low/high
             temperature_label = forecast_panel.children[f"temperature_label_{i}"]
-            temperature_label.config(text=f"Temp: {temperature_value:.2f}{temperature_unit_label}")
+            temperature_label.config(text=f"Temp: {temperature_fivedays[i]:.2f}{temperature_unit_label} "
+                                          f"({temperature_min[i]:.0f}/{temperature_max[i]:.0f})")
     # -------------------------------------------------------------------------------------
     # Function to create a wind direction map
     def create_wind_map(self, city):
+        self.worker.submit("wind-map", self.build_wind_map, self.open_wind_map, city)
+
+    # Function to open a saved wind map in the browser (runs on the Tk thread)
+    def open_wind_map(self, map_filename):
+        if map_filename is not None:
+            webbrowser.open_new_tab(pathlib.Path(map_filename).as_uri())
+
+    # Function to build and save the wind direction map, returns its filename (runs in a worker thread)
+    def build_wind_map(self, city):
         try:
-            result = self.api.get_weather(city)
+            return save_wind_map(self.api, self.wind_maps, city)
+        except Exception as e:
+            self.api.show_error("Error", f"An error occurred: {e}")
+        return None
+# -------------------------------------------------------------------------------------
+# Function to report how long this process took to import final.py and to draw the first window
+def startup_probe():
+    import_time = time.perf_counter() - STARTED_AT
+    app = WeatherApp("", prewarm_icons=False, warm_up=False)
+    app.update()  # Process pending draws so the window is on screen
+    first_window = time.perf_counter() - STARTED_AT
+    loaded = [module._name for module in LAZY_MODULES if module.is_loaded()]
+    app.destroy()
+    print(json.dumps({"import_time": import_time, "first_window": first_window, "loaded_at_first_window": loaded}))
+
+
+# Function to measure cold start in fresh processes and print the medians as JSON (seconds)
+def benchmark_startup(runs=5):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--startup-probe"],
+                                capture_output=True, text=True, check=True).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process_total"] = time.perf_counter() - started  # Includes interpreter start and exit
+        samples.append(sample)
+    report = {key: round(statistics.median(sample[key] for sample in samples), 4)
+              for key in ("import_time", "first_window", "process_total")}
+    report["runs"] = runs
+    report["loaded_at_first_window"] = samples[-1]["loaded_at_first_window"]
+    print(json.dumps(report))
+    return report
+
+
+# Function to time each user action against a ReplayTransport, without network, display or the user's cache
+# Returns a report of HTTP calls and median latency (ms) per action, cold (empty cache) and warm, plus bulk throughput
+def benchmark_actions(runs=10, latency=0.05, error_rate=0.0, fixtures=None, bulk_cities=200):
+    scratch = tempfile.mkdtemp(prefix="weatherwise-bench-")
+    apis = []  # Their executors are shut down however the run ends
+    try:
+        transport = ReplayTransport(fixtures, latency=latency, error_rate=error_rate, seed=0)
+        api = WeatherAPI("replay", transport=transport, timezones=TimezoneStore(os.path.join(scratch, "timezones.json")))
+        apis.append(api)
+        api.show_error = lambda title, message: None  # Injected errors are counted, not shown
+        icons = IconCache(transport, os.path.join(scratch, "icons"))
+        wind_maps = WindMapCache(os.path.join(scratch, "maps"))
+        backend_agg = importlib.import_module("matplotlib.backends.backend_agg")
+        figure = mpl_figure.Figure(figsize=(10, 6))
+        canvas = backend_agg.FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+
+        # The work done by each button, from the API call to the drawn result
+        def search(city):
+            result = api.get_weather(city)
+            api.get_current_time(city)
+            if result is not None:
+                icons.load(IconCache.icon_id(result.icon_url))
 
+        def hourly(city):
+            result = api.get_weather(city, hourly=True)
             if result is not None:
-                lat, lon = result[-2], result[-1]
-                wind_direction = result[6]
-
-                # Create a folium map centered around the city
-                weather_map = folium.Map(location=[lat, lon], zoom_start=11)
-
-                # Add a marker for the city
-                folium.Marker([lat, lon], popup=f"{city}, Wind Direction: {self.api.get_wind_direction(wind_direction)}").add_to(weather_map)
-
-                # Add arrow icons to represent wind direction
-                arrow_icons = {
-                    'N': 'https://cdn1.iconfinder.com/data/icons/arrow-for-love/512/arrrow-09-23-1024.png',
-                    'E': 'https://cdn1.iconfinder.com/data/icons/arrow-for-love/512/arrrow-09-24-1024.png',
-                    'S': 'https://cdn1.iconfinder.com/data/icons/arrow-for-love/512/arrrow-09-22-1024.png',
-                    'W': 'https://cdn1.iconfinder.com/data/icons/arrow-for-love/512/arrrow-09-21-1024.png',
-                    'NE': 'https://cdn1.iconfinder.com/data/icons/arrow-for-love/512/arrrow-09-06-1024.png',
-                    'SE': 'https://cdn1.iconfinder.com/data/icons/arrow-for-love/512/arrrow-09-08-1024.png',
-                    'SW': 'https://cdn1.iconfinder.com/data/icons/arrow-for-love/512/arrrow-09-05-1024.png',
-                    'NW': 'https://cdn1.iconfinder.com/data/icons/arrow-for-love/512/arrrow-09-07-1024.png'
-                }
-
-                # Add five arrow markers in a straight line
-                for i in range(5):
-                    arrow_icon_url = arrow_icons.get(self.api.get_wind_direction(wind_direction), '')
-                    if arrow_icon_url:
-                        # Create a new CustomIcon for each marker
-                        arrow_icon = folium.CustomIcon(icon_image=arrow_icon_url, icon_size=(50, 50))
-                        folium.Marker([lat - 0.05 + i * 0.03, lon - 0.05 + i * 0.03], popup="Wind Direction", icon=arrow_icon).add_to(weather_map)
-
-                map_filename = f"{city}_wind_map.html"
-                weather_map.save(map_filename)
-
-                # Open the HTML file in a web browser
-                webbrowser.open_new_tab(map_filename)
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {e}")
+                axes.clear()
+                axes.plot(result.timestamps, result.hourly_temperatures, marker='o', linestyle='-', color='orange')
+                canvas.draw()
+
+        def five_day(city):
+            results = api.get_5_day_weather(city)
+            if results:
+                for icon_id in results[2][:5]:
+                    icons.load(icon_id)
+
+        def wind_map(city):
+            save_wind_map(api, wind_maps, city)
+
+        warm_up_imports()
+        report = {"runs": runs, "latency": latency, "error_rate": error_rate, "actions": {}}
+        cities = WeatherApp.cities_names
+        for name, action in (("search", search), ("hourly", hourly), ("five_day", five_day), ("map", wind_map)):
+            samples = {"cold": [], "warm": []}
+            calls = {"cold": [], "warm": []}
+            for run in range(runs):
+                city = cities[run % len(cities)]
+                api.cache.clear()
+                for state in ("cold", "warm"):
+                    before = sum(transport.calls.values())
+                    started = time.perf_counter()
+                    action(city)
+                    samples[state].append((time.perf_counter() - started) * 1000)
+                    calls[state].append(sum(transport.calls.values()) - before)
+            report["actions"][name] = {f"{state}_{key}": round(statistics.median(values), 3)
+                                       for state in ("cold", "warm")
+                                       for key, values in (("ms", samples[state]), ("calls", calls[state]))}
+
+        # Bulk refresh of many cities from a cold cache, the first run learns city ids, the second uses /group
+        bulk_api = WeatherAPI("replay", transport=transport, cache_size=4 * bulk_cities,
+                              timezones=TimezoneStore(os.path.join(scratch, "bulk_timezones.json")))
+        apis.append(bulk_api)
+        fetcher = BulkFetcher(bulk_api, ids_path=os.path.join(scratch, "city_ids.json"))
+        names = [cities[i] if i < len(cities) else f"{cities[i % len(cities)]} {i}" for i in range(bulk_cities)]
+        for label in ("bulk_first", "bulk_repeat"):
+            bulk_api.cache.clear()
+            before = sum(transport.calls.values())
+            started = time.perf_counter()
+            records = list(fetcher.fetch(names))
+            elapsed = time.perf_counter() - started
+            report[label] = {"cities": len(records), "seconds": round(elapsed, 3), "cities_per_second": round(len(records) / elapsed, 1),
+                             "calls": sum(transport.calls.values()) - before,
+                             "errors": sum(1 for record in records if "error" in record)}
+        report["bytes"] = transport.bytes
+        if METRICS.enabled:
+            report["metrics"] = METRICS.snapshot()
+        return report
+    finally:
+        for each in apis:
+            each.executor.shutdown()
+        shutil.rmtree(scratch, True)
+
+
+# Function to compare a benchmark report with a saved baseline, returns the list of regressions
+# Calls may never increase; latencies may grow by `tolerance` (a share) plus 2 ms of timer noise
+def benchmark_regressions(report, baseline, tolerance=0.25):
+    regressions = []
+    for name, metrics in report["actions"].items():
+        for key, value in metrics.items():
+            previous = baseline.get("actions", {}).get(name, {}).get(key)
+            if previous is None:
+                continue
+            limit = previous if key.endswith("_calls") else previous * (1 + tolerance) + 2
+            if value > limit:
+                regressions.append(f"{name}.{key}: {value} > {previous}")
+    for label in ("bulk_first", "bulk_repeat"):
+        previous = baseline.get(label)
+        if previous is None:
+            continue
+        if report[label]["calls"] > previous["calls"]:
+            regressions.append(f"{label}.calls: {report[label]['calls']} > {previous['calls']}")
+        if report[label]["cities_per_second"] < previous["cities_per_second"] / (1 + tolerance):
+            regressions.append(f"{label}.cities_per_second: {report[label]['cities_per_second']} < {previous['cities_per_second']}")
+    return regressions
+
+
+# Function to start the app, or a headless mode when one is requested on the command line
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WeatherWise weather application")
+    parser.add_argument("--api-key", default=os.environ.get("OWM_API_KEY", ""), help="OpenWeatherMap API key (default: $OWM_API_KEY)")
+    parser.add_argument("--bulk", nargs="*", metavar="CITY", help="fetch cities headlessly and print JSON lines (all known cities when none are given)")
+    parser.add_argument("--forecast", action="store_true", help="with --bulk, also fetch the 5-day forecast of every city")
+    parser.add_argument("--output", default="-", help="with --bulk, file to write JSON lines to (default: stdout); "
+                                                      "with --wind-field, map file (default: ~/.cache/weatherwise/maps/wind_field.html, "
+                                                      "or the scratch folder removed on exit with --replay)")
+    parser.add_argument("--rate", type=float, default=55, help="with --bulk or --serve, maximum API calls per minute (default: 55)")
+    parser.add_argument("--workers", type=int, default=8, help="with --bulk or --serve, concurrent requests (default: 8)")
+    parser.add_argument("--wind-field", nargs="*", metavar="CITY", help="save one map with the wind of many cities (all known cities when none are given)")
+    parser.add_argument("--region", type=parse_region, metavar="S,W,N,E",
+                        help="with --wind-field, only show cities inside this latitude/longitude box (W > E crosses the 180th meridian)")
+    parser.add_argument("--history", metavar="CITY", help="print a city's stored observation trend as JSON lines, without network access")
+    parser.add_argument("--days", type=float, default=30, help="with --history, how far back to look (default: 30)")
+    parser.add_argument("--bucket", type=int, default=3600, help="with --history, seconds per averaged point (default: 3600)")
+    parser.add_argument("--favourites", nargs="*", metavar="CITY", help="save the cities the GUI keeps refreshed in the background "
+                                                                         "(none given: clear them)")
+    parser.add_argument("--quota", type=int, default=60, help="API calls per minute allowed by your plan (default: 60)")
+    parser.add_argument("--serve", type=int, nargs="?", const=8080, metavar="PORT",
+                        help="run a local JSON service for /current, /hourly and /five-day instead of the GUI (default port: 8080)")
+    parser.add_argument("--host", default="127.0.0.1", help="with --serve, address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--build-city-index", metavar="CITY_LIST", help="build the offline city index from OWM's city.list.json(.gz) and exit")
+    parser.add_argument("--bench-startup", type=int, nargs="?", const=5, metavar="RUNS", help="measure import time and time to first window (default: 5 runs)")
+    parser.add_argument("--replay", nargs="?", const="", metavar="FIXTURES",
+                        help="answer every request offline, from recorded fixture files in FIXTURES or from synthetic data")
+    parser.add_argument("--record", action="store_true", help="with --replay FIXTURES, fetch missing fixtures from OpenWeatherMap and save them")
+    parser.add_argument("--latency", type=float, default=None, help="with --replay or --bench, seconds added to every request (default: 0, 0.05 for --bench)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="with --replay or --bench, share of requests failing with HTTP 503")
+    parser.add_argument("--bench", type=int, nargs="?", const=10, metavar="RUNS",
+                        help="measure HTTP calls and latency of each action and bulk throughput offline, print JSON (default: 10 runs)")
+    parser.add_argument("--bench-baseline", metavar="FILE", help="with --bench, fail when slower or chattier than the report in FILE "
+                                                                 "(written there when missing)")
+    parser.add_argument("--metrics", metavar="FILE", help="time every stage and append it to FILE as JSON lines, with a summary line at exit")
+    parser.add_argument("--startup-probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.startup_probe:
+        startup_probe()
+        return
+    if args.bench_startup:
+        benchmark_startup(args.bench_startup)
+        return
+    if args.metrics:
+        METRICS.enable(args.metrics)
+        atexit.register(METRICS.close)
+    if args.bench:
+        report = benchmark_actions(args.bench, 0.05 if args.latency is None else args.latency, args.error_rate, args.replay or None)
+        print(json.dumps(report, indent=2))
+        if args.bench_baseline:
+            if not os.path.exists(args.bench_baseline):
+                with open(args.bench_baseline, "w", encoding="utf-8") as file:
+                    json.dump(report, file, indent=2)
+                return
+            with open(args.bench_baseline, encoding="utf-8") as file:
+                regressions = benchmark_regressions(report, json.load(file))
+            if regressions:
+                print("Regressions against " + args.bench_baseline + ":\n  " + "\n  ".join(regressions), file=sys.stderr)
+                sys.exit(1)
+        return
+
+    transport = None
+    if args.replay is not None:
+        transport = ReplayTransport(args.replay or None, latency=args.latency or 0.0, error_rate=args.error_rate,
+                                    upstream=HTTPTransport() if args.record else None)
+    # Replayed data goes to a scratch folder, so no made-up city id, offset, icon, map or observation reaches the real cache
+    data_dir = CACHE_DIR
+    if transport is not None:
+        data_dir = tempfile.mkdtemp(prefix="weatherwise-replay-")
+        atexit.register(shutil.rmtree, data_dir, True)
+
+    api_key = args.api_key
+    if args.build_city_index:
+        index = CityIndex.from_owm_catalogue(args.build_city_index)
+        index.save(os.path.join(CACHE_DIR, "cities.idx"))
+        print(f"Indexed {len(index)} cities into {os.path.join(CACHE_DIR, 'cities.idx')}")
+        return
+
+    if args.history:
+        history = HistoryStore()
+        now = int(time.time())
+        rows = history.trend(WeatherAPI.normalize_city(args.history), now - int(args.days * 86400), now, args.bucket)
+        columns = ("time", "temperature", "temperature_min", "temperature_max", "humidity", "wind_speed", "count")
+        write_jsonl((dict(zip(columns, row)) for row in rows), sys.stdout)
+        return
+
+    if args.bulk is not None or args.wind_field is not None or args.serve is not None:
+        history = HistoryStore(os.path.join(data_dir, "history.sqlite3"))
+        atexit.register(history.close)
+        # Replayed data is not rate limited
+        api = WeatherAPI(api_key, cache_size=4096, rate_limiter=TokenBucket(args.rate) if transport is None else None,
+                         max_workers=args.workers, city_index=CityIndex.load_default(), history=history, transport=transport,
+                         timezones=TimezoneStore(os.path.join(data_dir, "timezones.json")))
+        atexit.register(api.timezones.save)
+        fetcher = BulkFetcher(api, max_workers=args.workers, ids_path=os.path.join(data_dir, "city_ids.json"))
+
+    if args.serve is not None:
+        # Report errors on stderr rather than in dialog boxes, favourites stay warm for every client
+        api.show_error = lambda title, message: print(f"{title}: {message}", file=sys.stderr)
+        RefreshScheduler(api, load_favourites(), quota_per_minute=args.quota).start()
+        try:
+            asyncio.run(WeatherServer(api, args.host, args.serve).serve())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.wind_field is not None:
+        records = [record for record in fetcher.fetch(args.wind_field or WeatherApp.cities_names) if "error" not in record]
+        if args.region:
+            records = in_region(records, args.region)
+        path = os.path.join(data_dir, "maps", "wind_field.html") if args.output == "-" else args.output
+        print(build_wind_field_map(records, path))
+        return
+
+    if args.bulk is not None:
+        records = fetcher.fetch(args.bulk or WeatherApp.cities_names, forecast=args.forecast)
+        if args.output == "-":
+            write_jsonl(records, sys.stdout)
+        else:
+            with open(args.output, "w", encoding="utf-8") as file:
+                write_jsonl(records, file)
+        return
+
+    if args.favourites is not None:
+        save_favourites(args.favourites)
+
+    app = WeatherApp(api_key, quota_per_minute=args.quota, transport=transport, data_dir=data_dir)
+    app.mainloop()
 # -------------------------------------------------------------------------------------
 if __name__ == "__main__":
-    api_key = "" 
-    app = WeatherApp(api_key)
-    app.mainloop()
+    main()